@@ -0,0 +1,107 @@
+"""
+
+OMMC PROBLEM OF THE DAY BOT - answers
+
+Parsers for each answer format. A parser turns an answer into a canonical value,
+so answers compare equal whenever they mean the same thing (`2/4` and `1/2`, or `.10` and `0.1`).
+
+"""
+
+
+import decimal
+import fractions
+import re
+from typing import Any, Callable
+
+MAX_ANSWER_LENGTH = 200
+MAX_FRACTION_PART = 1_000_000
+INTEGER_RE = re.compile(r'[+-]?\d+')
+FRACTION_RE = re.compile(r'([+-]?\d+)\s*(?:/\s*(\d+))?')
+DECIMAL_RE = re.compile(r'[+-]?(?:\d+\.?\d*|\.\d+)')
+LIST_SPLIT_RE = re.compile(r'\s*[,;]\s*')
+WHITESPACE_RE = re.compile(r'\s+')
+
+
+class AnswerError(ValueError):
+    """Raised by the answer parsers. The message is shown to the user."""
+
+
+def parse_integer(answer: str) -> int:
+    if INTEGER_RE.fullmatch(answer) is None:
+        raise AnswerError('This is an invalid integer. Enter an integer, like `10` or `-2`.')
+    return int(answer)
+
+
+def parse_fraction(answer: str) -> fractions.Fraction:
+    match = FRACTION_RE.fullmatch(answer)
+    if match is None:
+        raise AnswerError('This is an invalid fraction. Enter `m/n` or `-m/n` where `m` and `n` are positive integers, like `5/3` or `-1/2`.')
+    denominator = int(match.group(2) or 1)
+    if denominator == 0:
+        raise AnswerError('The denominator cannot be zero.')
+    value = fractions.Fraction(int(match.group(1)), denominator)
+    if abs(value.numerator) > MAX_FRACTION_PART or value.denominator > MAX_FRACTION_PART:
+        raise AnswerError('Fraction too large!')
+    return value
+
+
+def parse_decimal(answer: str) -> fractions.Fraction:
+    if DECIMAL_RE.fullmatch(answer) is None:
+        raise AnswerError('This is an invalid decimal. Enter a number like `3.25` or `-0.5`.')
+    # Exact value, so 0.10 and .1 compare equal
+    return fractions.Fraction(decimal.Decimal(answer))
+
+
+def parse_number(answer: str) -> fractions.Fraction:
+    """Parses an integer, fraction or decimal"""
+    if DECIMAL_RE.fullmatch(answer) is not None:
+        return parse_decimal(answer)
+    return parse_fraction(answer)
+
+
+def parse_list(answer: str) -> tuple[fractions.Fraction, ...]:
+    items = LIST_SPLIT_RE.split(answer.strip('()[]{} '))
+    try:
+        return tuple(parse_number(item) for item in items)
+    except AnswerError:
+        raise AnswerError('This is an invalid list. Enter numbers separated by commas, like `1, 2/3, -4`.')
+
+
+def parse_set(answer: str) -> frozenset[fractions.Fraction]:
+    try:
+        return frozenset(parse_list(answer))
+    except AnswerError:
+        raise AnswerError('This is an invalid set. Enter numbers separated by commas in any order, like `1, 2/3, -4`.')
+
+
+def parse_string(answer: str) -> str:
+    return WHITESPACE_RE.sub(' ', answer)
+
+
+ANSWER_PARSERS: dict[str, Callable[[str], Any]] = {
+    'integer': parse_integer,
+    'fraction': parse_fraction,
+    'decimal': parse_decimal,
+    'list': parse_list,
+    'set': parse_set,
+    'string': parse_string,
+}
+
+
+def parse_answer(answer: str, answerformat: str) -> Any:
+    """Parses :answer: to the canonical value for :answerformat:. Raises AnswerError if it is invalid."""
+    parser = ANSWER_PARSERS.get(answerformat)
+    if parser is None:
+        raise AnswerError('Invalid answer format supplied by the problem. Contact admin.')
+    if len(answer) > MAX_ANSWER_LENGTH:
+        raise AnswerError('Answer too long!')
+    return parser(answer.strip().lower())
+
+
+def validate_answer(answer: str, answerformat: str) -> tuple[bool, str]:
+    """Validates :answer: to :answerformat:. Returns a tuple[success or not, message if failed]"""
+    try:
+        parse_answer(answer, answerformat)
+    except AnswerError as e:
+        return False, str(e)
+    return True, ''
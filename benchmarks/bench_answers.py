@@ -0,0 +1,40 @@
+"""
+
+Micro-benchmark of the per-message answer check: parsing a DM and comparing it to
+the pre-parsed answer of the current problem.
+
+Usage: python benchmarks/bench_answers.py [iterations]
+
+"""
+
+
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from answers import parse_answer  # noqa: E402
+
+CASES = [
+    ('integer', '42', ' +42 '),
+    ('fraction', '5/3', '10/6'),
+    ('decimal', '3.25', '3.250'),
+    ('list', '1, 2/3, -4', '(1, 4/6, -4)'),
+    ('set', '1, 2/3, -4', '{-4, 1, 2/3}'),
+    ('string', 'hello world', '  Hello   World '),
+]
+
+
+def main():
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    print(f'{"format":<10} {"ns/message":>12}')
+    for answerformat, answer, submission in CASES:
+        expected = parse_answer(answer, answerformat)
+        assert parse_answer(submission, answerformat) == expected
+        seconds = timeit.timeit(lambda: parse_answer(submission, answerformat) == expected, number=iterations)
+        print(f'{answerformat:<10} {seconds / iterations * 1e9:>12.0f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,242 @@
+"""
+
+In-process stand-in for the parts of discord.py the bot uses, for offline load tests.
+
+Every REST call goes through FakeNetwork, which adds latency, enforces per-route
+and global rate limits (waiting out a 429 the way discord.py does) and can inject
+server errors.
+
+"""
+
+
+import asyncio
+import collections
+import random
+from typing import Any, Callable, Optional
+
+import discord
+
+GLOBAL_RATE_LIMIT = 50  # requests per second
+
+
+class FakeResponse:
+    """Just enough of aiohttp.ClientResponse for discord.HTTPException"""
+
+    def __init__(self, status: int, reason: str):
+        self.status = status
+        self.reason = reason
+
+
+class FakeNetwork:
+    """Latency, rate limits and failures shared by all fake objects"""
+
+    def __init__(self, latency: float = 0.05, jitter: float = 0.02, error_rate: float = 0.0,
+                 rate_limit_scale: float = 1.0, seed: int = 0):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.rate_limit_scale = rate_limit_scale
+        self.random = random.Random(seed)
+        self.requests = 0
+        self.rate_limited = 0
+        self.errors = 0
+        self.requests_by_route: collections.Counter = collections.Counter()
+        self._windows: dict[str, collections.deque] = collections.defaultdict(collections.deque)
+
+    async def _take(self, bucket: str, limit: int, period: float) -> None:
+        """Waits until :bucket: has room for one more request"""
+        window = self._windows[bucket]
+        limit = max(int(limit * self.rate_limit_scale), 1)
+        loop = asyncio.get_running_loop()
+        limited = False
+        while True:
+            now = loop.time()
+            while window and window[0] <= now - period:
+                window.popleft()
+            if len(window) < limit:
+                window.append(now)
+                return
+            if not limited:
+                # 429: wait for retry_after like discord.py does
+                limited = True
+                self.rate_limited += 1
+            await asyncio.sleep(window[0] + period - now)
+
+    async def request(self, route: str, limit: int = 5, period: float = 5.0) -> None:
+        """Simulates one REST request on :route:, whose bucket allows :limit: requests per :period: seconds"""
+        self.requests += 1
+        self.requests_by_route[route.split(' ', 1)[0]] += 1
+        await self._take('global', GLOBAL_RATE_LIMIT, 1.0)
+        await self._take(route, limit, period)
+        await asyncio.sleep(max(self.random.gauss(self.latency, self.jitter), 0.0))
+        if self.random.random() < self.error_rate:
+            self.errors += 1
+            raise discord.errors.HTTPException(FakeResponse(500, 'Internal Server Error'), 'injected failure')
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            'requests': self.requests,
+            'rate_limited': self.rate_limited,
+            'errors': self.errors,
+            'requests_by_route': dict(self.requests_by_route),
+        }
+
+
+class FakeChannel:
+    def __init__(self, network: FakeNetwork, channel_id: int, channel_type: discord.ChannelType):
+        self.network = network
+        self.id = channel_id
+        self.type = channel_type
+        self.sent: list[Any] = []
+
+    async def send(self, content: Optional[str] = None, **kwargs) -> None:
+        await self.network.request(f'messages channel={self.id}')
+        self.sent.append(content if content is not None else kwargs)
+
+
+class FakeUser:
+    bot = False
+
+    def __init__(self, network: FakeNetwork, user_id: int):
+        self.id = user_id
+        self.name = f'user{user_id}'
+        self.display_name = self.name
+        self.roles: list['FakeRole'] = []
+        self.dm_channel = FakeChannel(network, user_id, discord.ChannelType.private)
+
+    async def send(self, content: Optional[str] = None, **kwargs) -> None:
+        await self.dm_channel.send(content, **kwargs)
+
+
+class FakeRole:
+    def __init__(self, guild: 'FakeGuild', role_id: int):
+        self.guild = guild
+        self.id = role_id
+
+
+class FakeMember(FakeUser):
+    def __init__(self, network: FakeNetwork, guild: 'FakeGuild', user_id: int):
+        super().__init__(network, user_id)
+        self.network = network
+        self.guild = guild
+
+    async def add_roles(self, *roles: FakeRole) -> None:
+        await self.network.request(f'roles guild={self.guild.id}', limit=10, period=10.0)
+        self.roles.extend(role for role in roles if role not in self.roles)
+
+    async def remove_roles(self, *roles: FakeRole) -> None:
+        await self.network.request(f'roles guild={self.guild.id}', limit=10, period=10.0)
+        self.roles = [role for role in self.roles if role not in roles]
+
+
+class FakeGuild:
+    def __init__(self, network: FakeNetwork, guild_id: int, role_ids: list[int], member_cache: bool = True):
+        self.network = network
+        self.id = guild_id
+        self.name = f'guild{guild_id}'
+        self.member_cache = member_cache
+        self.roles = {role_id: FakeRole(self, role_id) for role_id in role_ids}
+        self.members: dict[int, FakeMember] = {}
+
+    def add_member(self, user_id: int) -> FakeMember:
+        member = self.members[user_id] = FakeMember(self.network, self, user_id)
+        return member
+
+    def get_role(self, role_id: int) -> Optional[FakeRole]:
+        return self.roles.get(role_id)
+
+    def get_member(self, user_id: int) -> Optional[FakeMember]:
+        return self.members.get(user_id) if self.member_cache else None
+
+    async def fetch_member(self, user_id: int) -> FakeMember:
+        await self.network.request(f'members guild={self.id}', limit=10, period=1.0)
+        if user_id not in self.members:
+            raise discord.errors.NotFound(FakeResponse(404, 'Not Found'), 'Unknown Member')
+        return self.members[user_id]
+
+
+class FakeMessage:
+    def __init__(self, author: FakeUser, content: str, channel: FakeChannel, guild: Optional[FakeGuild] = None):
+        self.author = author
+        self.content = content
+        self.channel = channel
+        self.guild = guild
+
+
+class FakeContext:
+    """Just enough of commands.Context for the Commands handlers"""
+
+    def __init__(self, author: FakeUser, channel: FakeChannel, guild: Optional[FakeGuild] = None):
+        self.author = author
+        self.channel = channel
+        self.guild = guild
+        self.command = None
+
+    async def send(self, content: Optional[str] = None, **kwargs) -> None:
+        await self.channel.send(content, **kwargs)
+
+
+class FakeBot:
+    """Stand-in for commands.Bot. Pass it to Router(client=...)."""
+
+    def __init__(self, network: FakeNetwork, guild: FakeGuild, gateway_cache: bool = True):
+        self.network = network
+        self.guild = guild
+        self.gateway_cache = gateway_cache
+        self.user = FakeUser(network, 0)
+        self.users: dict[int, FakeUser] = {}
+        self.channels: dict[int, FakeChannel] = {}
+        self.listeners: dict[str, list[Callable]] = collections.defaultdict(list)
+        self.cogs: list[Any] = []
+
+    def add_channel(self, channel_id: int) -> FakeChannel:
+        channel = self.channels[channel_id] = FakeChannel(self.network, channel_id, discord.ChannelType.text)
+        return channel
+
+    def add_user(self, user_id: int) -> FakeMember:
+        """Adds a user who is a member of the guild"""
+        member = self.guild.add_member(user_id)
+        self.users[user_id] = member
+        return member
+
+    # commands.Bot API
+
+    def remove_command(self, name: str) -> None:
+        pass
+
+    def event(self, coro: Callable) -> Callable:
+        setattr(self, coro.__name__, coro)
+        return coro
+
+    def add_listener(self, func: Callable, name: Optional[str] = None) -> None:
+        self.listeners[name or func.__name__].append(func)
+
+    async def add_cog(self, cog: Any) -> None:
+        self.cogs.append(cog)
+
+    async def process_commands(self, message: FakeMessage) -> None:
+        pass
+
+    def get_command(self, name: str) -> None:
+        return None
+
+    def get_guild(self, guild_id: int) -> Optional[FakeGuild]:
+        return self.guild if self.gateway_cache and guild_id == self.guild.id else None
+
+    async def fetch_guild(self, guild_id: int) -> FakeGuild:
+        await self.network.request('guilds', limit=5, period=1.0)
+        if guild_id != self.guild.id:
+            raise discord.errors.NotFound(FakeResponse(404, 'Not Found'), 'Unknown Guild')
+        return self.guild
+
+    def get_user(self, user_id: int) -> Optional[FakeUser]:
+        return self.users.get(user_id)
+
+    def get_channel(self, channel_id: int) -> Optional[FakeChannel]:
+        return self.channels.get(channel_id) if self.gateway_cache else None
+
+    async def fetch_channel(self, channel_id: int) -> FakeChannel:
+        await self.network.request('channels', limit=5, period=1.0)
+        if channel_id not in self.channels:
+            raise discord.errors.NotFound(FakeResponse(404, 'Not Found'), 'Unknown Channel')
+        return self.channels[channel_id]
@@ -0,0 +1,253 @@
+"""
+
+Offline load test of Main and Commands against a fake Discord (see fakediscord.py).
+
+Runs scripted workloads and reports p50/p99 latency, throughput and peak memory:
+
+answers        --users people DM answers within --burst seconds (some invalid, some wrong),
+               while --spammers others each send --spam-messages DMs as fast as they can
+reset          next_problem with everyone who solved, including DMs and role removals
+leaderboard    --queries leaderboard calls, half with a random page
+problemstatus  --queries problemstatus calls
+
+Discord's rate limits make real resets slow; --rate-limit-scale 20 gives a quick run.
+Results are written as JSON with --output. --compare prints the change against an
+earlier result and exits with status 1 if anything got slower than --tolerance.
+
+Usage: python benchmarks/loadtest.py [--users 500] [--latency 0.05] [--output new.json] [--compare old.json]
+
+"""
+
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import pickle
+import platform
+import random
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+from typing import Any, Awaitable, Callable
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import main  # noqa: E402
+import storage  # noqa: E402
+from fakediscord import FakeBot, FakeContext, FakeGuild, FakeMessage, FakeNetwork  # noqa: E402
+
+GUILD_ID = 1000
+PROBLEM_CHANNEL_ID = 1001
+SOLVED_ROLE_ID = 1002
+STAFF_ROLE_ID = 1003
+FIRST_USER_ID = 10_000
+COMPARED_METRICS = (('p50_ms', False), ('p99_ms', False), ('throughput_per_s', True), ('peak_memory_kb', False))
+
+
+def percentile(samples: list[float], fraction: float) -> float:
+    if not samples:
+        return 0.0
+    samples = sorted(samples)
+    return samples[min(int(fraction * len(samples)), len(samples) - 1)]
+
+
+async def measure(name: str, calls: list[Callable[[], Awaitable[Any]]], network: FakeNetwork) -> dict[str, Any]:
+    """Runs :calls: concurrently, timing each one"""
+    latencies = []
+
+    async def timed(call: Callable[[], Awaitable[Any]]) -> None:
+        start = time.perf_counter()
+        await call()
+        latencies.append(time.perf_counter() - start)
+
+    requests_before, rate_limited_before = network.requests, network.rate_limited
+    tracemalloc.start()
+    start = time.perf_counter()
+    await asyncio.gather(*(timed(call) for call in calls))
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    result = {
+        'count': len(calls),
+        'elapsed_s': round(elapsed, 3),
+        'p50_ms': round(percentile(latencies, 0.5) * 1000, 2),
+        'p99_ms': round(percentile(latencies, 0.99) * 1000, 2),
+        'mean_ms': round(statistics.fmean(latencies) * 1000, 2) if latencies else 0.0,
+        'throughput_per_s': round(len(calls) / elapsed, 1) if elapsed else 0.0,
+        'peak_memory_kb': round(peak / 1024, 1),
+        'requests': network.requests - requests_before,
+        'rate_limited': network.rate_limited - rate_limited_before,
+    }
+    print(f'{name:<14} n={result["count"]:<6} p50={result["p50_ms"]:>9.2f}ms p99={result["p99_ms"]:>9.2f}ms '
+          f'{result["throughput_per_s"]:>9.1f}/s peak={result["peak_memory_kb"]:>9.1f}KiB '
+          f'requests={result["requests"]} 429s={result["rate_limited"]}')
+    return result
+
+
+def write_data(args: argparse.Namespace, rng: random.Random) -> None:
+    """Writes config.json and a data.pickle with --existing-users scored users into the working directory"""
+    config = {
+        'prefix': '-',
+        'token': '',
+        'problemchannel': PROBLEM_CHANNEL_ID,
+        'solvedrole': SOLVED_ROLE_ID,
+        'guildid': GUILD_ID,
+        'staffroleid': STAFF_ROLE_ID,
+        'storage': args.storage,
+        'checkimages': False,
+    }
+    with open('config.json', 'w') as f:
+        json.dump(config, f)
+    data = storage.get_default_data()
+    data['problems'] = [{'imageurl': 'https://example.com/problem.png', 'answer': str(i), 'answerformat': 'integer'}
+                        for i in range(3)]
+    data['state']['lastreset'] = list(time.localtime()[:3])
+    for i in range(args.existing_users):
+        data['users'][FIRST_USER_ID + args.users + i] = {'totalscore': rng.randrange(0, 3000)}
+    with open('data.pickle', 'wb') as f:
+        pickle.dump(data, f)
+
+
+async def run_workloads(args: argparse.Namespace) -> dict[str, Any]:
+    rng = random.Random(args.seed)
+    network = FakeNetwork(latency=args.latency, jitter=args.latency / 3, error_rate=args.error_rate,
+                          rate_limit_scale=args.rate_limit_scale, seed=args.seed)
+    guild = FakeGuild(network, GUILD_ID, [SOLVED_ROLE_ID, STAFF_ROLE_ID], member_cache=not args.cold_cache)
+    bot = FakeBot(network, guild, gateway_cache=not args.cold_cache)
+    bot.add_channel(PROBLEM_CHANNEL_ID)
+    users = [bot.add_user(FIRST_USER_ID + i) for i in range(args.users)]
+    spammers = [bot.add_user(FIRST_USER_ID + args.users + args.existing_users + i) for i in range(args.spammers)]
+    write_data(args, rng)
+
+    router = main.Router(client=bot)
+    bot_main = router.seasons[0]
+    cog = main.Commands(router)
+    workers = [asyncio.create_task(bot_main.role_grant_worker()) for _ in range(main.ROLE_CONCURRENCY)]
+    answer = bot_main.problems[bot_main.state['currentproblemid']]['answer']
+    results = {}
+
+    async def answer_script(user: Any) -> None:
+        await asyncio.sleep(rng.uniform(0, args.burst))
+        if rng.random() < 0.2:
+            await router.on_message(FakeMessage(user, 'not a number', user.dm_channel))
+        if rng.random() < 0.4:
+            await router.on_message(FakeMessage(user, str(int(answer) + 1), user.dm_channel))
+        await router.on_message(FakeMessage(user, answer, user.dm_channel))
+
+    # The answer scripts sleep until their arrival time, so time each message rather than each script
+    message_latencies = []
+    on_message = router.on_message
+
+    async def spam_script(user: Any) -> None:
+        for _ in range(args.spam_messages):
+            await on_message(FakeMessage(user, str(rng.randrange(1000)), user.dm_channel))
+            await asyncio.sleep(0)
+
+    async def timed_on_message(message: FakeMessage) -> None:
+        start = time.perf_counter()
+        await on_message(message)
+        message_latencies.append(time.perf_counter() - start)
+
+    router.on_message = timed_on_message
+    dropped_before = sum(main.metrics.dropped.values.values())
+    answers = await measure('answer scripts', [lambda user=user: answer_script(user) for user in users]
+                            + [lambda user=user: spam_script(user) for user in spammers], network)
+    await bot_main.role_grants.join()
+    answers.update(
+        count=len(message_latencies),
+        p50_ms=round(percentile(message_latencies, 0.5) * 1000, 2),
+        p99_ms=round(percentile(message_latencies, 0.99) * 1000, 2),
+        mean_ms=round(statistics.fmean(message_latencies) * 1000, 2),
+        throughput_per_s=round(len(message_latencies) / answers['elapsed_s'], 1),
+        spam_dropped=int(sum(main.metrics.dropped.values.values()) - dropped_before),
+    )
+    print(f'{"answers":<14} n={answers["count"]:<6} p50={answers["p50_ms"]:>9.2f}ms p99={answers["p99_ms"]:>9.2f}ms per message '
+          f'({answers["spam_dropped"]} of {args.spammers * args.spam_messages} spam messages dropped)')
+    results['answers'] = answers
+    router.on_message = on_message
+
+    # Each query replies in its own channel so the per-channel rate limit does not dominate
+    queries = [FakeContext(users[i % len(users)], users[i % len(users)].dm_channel, guild) for i in range(args.queries)]
+    for ctx in queries:
+        cog.cog_check(ctx)  # sets ctx.main like a real invocation
+    results['leaderboard'] = await measure(
+        'leaderboard', [lambda ctx=ctx: cog.leaderboard.callback(cog, ctx, rng.choice([None, rng.randrange(1, 50)]))
+                        for ctx in queries], network)
+    results['problemstatus'] = await measure(
+        'problemstatus', [lambda ctx=ctx: cog.problemstatus.callback(cog, ctx) for ctx in queries], network)
+    problem_id = bot_main.state['currentproblemid']
+    results['reset'] = await measure('reset', [lambda: bot_main.next_problem(problem_id)], network)
+
+    for worker in workers:
+        worker.cancel()
+    bot_main.storage.close()
+    return {
+        'meta': {
+            'args': vars(args),
+            'python': platform.python_version(),
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'network': network.stats(),
+        },
+        'workloads': results,
+    }
+
+
+def compare(old: dict[str, Any], new: dict[str, Any], tolerance: float) -> bool:
+    """Prints the change of each metric. Returns False if a metric regressed by more than :tolerance:."""
+    ok = True
+    for name, new_result in new['workloads'].items():
+        old_result = old['workloads'].get(name)
+        if old_result is None:
+            continue
+        for metric, higher_is_better in COMPARED_METRICS:
+            before, after = old_result[metric], new_result[metric]
+            if not before:
+                continue
+            change = (after - before) / before
+            regressed = (-change if higher_is_better else change) > tolerance
+            ok = ok and not regressed
+            print(f'{"!!" if regressed else "  "} {name:<14} {metric:<17} {before:>11} -> {after:>11} ({change:+.1%})')
+    return ok
+
+
+def main_cli() -> None:
+    parser = argparse.ArgumentParser(description='Offline load test against a fake Discord')
+    parser.add_argument('--users', type=int, default=500, help='people answering the current problem')
+    parser.add_argument('--spammers', type=int, default=0, help='people flooding the bot with DMs during the answers workload')
+    parser.add_argument('--spam-messages', type=int, default=200, help='DMs each spammer sends')
+    parser.add_argument('--existing-users', type=int, default=5000, help='scored users who do not answer')
+    parser.add_argument('--burst', type=float, default=5.0, help='seconds over which answers arrive')
+    parser.add_argument('--queries', type=int, default=500, help='leaderboard/problemstatus calls')
+    parser.add_argument('--latency', type=float, default=0.05, help='mean REST latency in seconds')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='fraction of REST calls failing with 500')
+    parser.add_argument('--rate-limit-scale', type=float, default=1.0, help='multiply every rate limit by this')
+    parser.add_argument('--cold-cache', action='store_true', help='disable the gateway cache (every lookup hits REST)')
+    parser.add_argument('--storage', choices=('pickle', 'sqlite'), default='pickle')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='write results as JSON to this file')
+    parser.add_argument('--compare', help='compare against results in this JSON file')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='allowed relative regression for --compare')
+    args = parser.parse_args()
+    output = os.path.abspath(args.output) if args.output else None
+    baseline = os.path.abspath(args.compare) if args.compare else None
+
+    logging.getLogger().setLevel(logging.WARNING)
+    with tempfile.TemporaryDirectory() as workdir:
+        os.chdir(workdir)
+        results = asyncio.run(run_workloads(args))
+
+    if output:
+        with open(output, 'w') as f:
+            json.dump(results, f, indent=2)
+    if baseline:
+        with open(baseline) as f:
+            if not compare(json.load(f), results, args.tolerance):
+                sys.exit(1)
+
+
+if __name__ == '__main__':
+    main_cli()
@@ -0,0 +1,175 @@
+"""
+
+OMMC PROBLEM OF THE DAY BOT - admin console
+
+A Python REPL on the bot's event loop. It never blocks the loop: input is read
+from a Unix socket with asyncio, or from stdin in a worker thread. Each input runs
+as a task with a timeout, so answers and the gateway keep going while staff debug.
+`await` works at the top level. Code that never awaits (e.g. a busy loop) still
+blocks the loop, as any code on it would.
+
+Set the `console` config key to a socket path (or to "stdin") and connect with
+`python console.py <path>`, `nc -U <path>` or `socat - UNIX-CONNECT:<path>`.
+
+"""
+
+
+import ast
+import asyncio
+import codecs
+import inspect
+import logging
+import os
+import socket
+import sys
+import threading
+import traceback
+from typing import Any, Awaitable, Callable, Optional, TextIO
+
+CONSOLE_TIMEOUT = 30.0  # seconds an input may run before it is cancelled
+
+
+async def run_code(source: str, namespace: dict[str, Any], output: TextIO, timeout: float = CONSOLE_TIMEOUT) -> None:
+    """Runs :source: in :namespace: as a task, writing the value of an expression and any traceback to :output:"""
+    namespace['print'] = lambda *args, **kwargs: print(*args, **kwargs, file=output)
+    flags = ast.PyCF_ALLOW_TOP_LEVEL_AWAIT
+    try:
+        code = compile(source, '<console>', 'eval', flags=flags)
+    except SyntaxError:
+        try:
+            code = compile(source, '<console>', 'exec', flags=flags)
+        except SyntaxError as e:
+            output.write(''.join(traceback.format_exception_only(e)))
+            return
+
+    async def run() -> Any:
+        result = eval(code, namespace)
+        if code.co_flags & inspect.CO_COROUTINE:
+            result = await result
+        return result
+
+    try:
+        result = await asyncio.wait_for(run(), timeout)
+    except asyncio.TimeoutError:
+        output.write(f'Timed out after {timeout:g}s and was cancelled.\n')
+    except Exception as e:
+        # Start the traceback at the console input
+        tb = e.__traceback__
+        while tb is not None and tb.tb_frame.f_code.co_filename != '<console>':
+            tb = tb.tb_next
+        output.write(''.join(traceback.format_exception(type(e), e, tb)))
+    else:
+        if result is not None:
+            output.write(f'{result!r}\n')
+
+
+async def repl(read_line: Callable[[], Awaitable[str]], output: TextIO, namespace: dict[str, Any]) -> None:
+    """Reads and runs inputs until :read_line: returns ''. A line ending in `:` starts a block that ends with an empty line."""
+    namespace = dict(namespace)
+    block = []
+    while True:
+        output.write('... ' if block else '>>> ')
+        output.flush()
+        line = await read_line()
+        if not line:
+            return
+        line = line.rstrip('\r\n')
+        if block and line.strip():
+            block.append(line)
+            continue
+        if not block and line.rstrip().endswith(':'):
+            block.append(line)
+            continue
+        source = '\n'.join(block) if block else line
+        block = []
+        if source.strip():
+            await run_code(source, namespace, output)
+
+
+class StreamOutput:
+    """Text file interface over an asyncio StreamWriter"""
+
+    def __init__(self, writer: asyncio.StreamWriter):
+        self.writer = writer
+
+    def write(self, text: str) -> int:
+        self.writer.write(text.encode())
+        return len(text)
+
+    def flush(self) -> None:
+        pass
+
+
+def stdin_lines() -> asyncio.Queue:
+    """Returns a queue of the lines of stdin, ending with ''.
+
+    stdin is read in a daemon thread: a thread blocked in readline must not keep the process from exiting.
+    """
+    loop = asyncio.get_running_loop()
+    lines: asyncio.Queue = asyncio.Queue()
+
+    def read() -> None:
+        while True:
+            line = sys.stdin.readline()
+            try:
+                loop.call_soon_threadsafe(lines.put_nowait, line)
+            except RuntimeError:  # the loop was closed while the bot exits
+                return
+            if not line:
+                return
+
+    threading.Thread(target=read, name='console-stdin', daemon=True).start()
+    return lines
+
+
+async def serve(path: str, namespace: dict[str, Any]) -> Optional[asyncio.AbstractServer]:
+    """Serves a REPL on the Unix socket :path:, or on stdin if :path: is 'stdin'"""
+    if path == 'stdin':
+        asyncio.create_task(repl(stdin_lines().get, sys.stdout, namespace))
+        logging.info('admin console reading stdin')
+        return None
+
+    async def handle(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        async def read_line() -> str:
+            return (await reader.readline()).decode(errors='replace')
+
+        try:
+            await repl(read_line, StreamOutput(writer), namespace)
+        finally:
+            writer.close()
+
+    if os.path.exists(path):
+        os.remove(path)  # left over from a previous run
+    umask = os.umask(0o177)  # only the bot's user may connect
+    try:
+        server = await asyncio.start_unix_server(handle, path)
+    finally:
+        os.umask(umask)
+    logging.info(f'admin console listening on {path}')
+    return server
+
+
+def main_cli(path: str) -> None:
+    """Connects to the console at :path: and relays stdin and stdout"""
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.connect(path)
+
+        def receive() -> None:
+            decoder = codecs.getincrementaldecoder('utf-8')('replace')
+            while data := sock.recv(4096):
+                sys.stdout.write(decoder.decode(data))
+                sys.stdout.flush()
+
+        receiver = threading.Thread(target=receive, daemon=True)
+        receiver.start()
+        for line in sys.stdin:
+            sock.sendall(line.encode())
+        sock.shutdown(socket.SHUT_WR)
+        receiver.join()
+
+
+if __name__ == '__main__':
+    if len(sys.argv) != 2:
+        print('usage: python console.py <socket path>')
+        sys.exit(2)
+    main_cli(sys.argv[1])
@@ -0,0 +1,194 @@
+"""
+
+OMMC PROBLEM OF THE DAY BOT - submission history
+
+Every judged answer is kept as one row of fixed-width columns: user, problem,
+attempt number (1 = first try), correctness, time, and seconds since the problem
+opened. Rows are appended to <datafile>.history as they come in and held in
+memory in segments of array.array columns, 26 bytes per submission.
+
+Statistics are computed over whole columns with NumPy, which is optional: without
+it the history is still recorded, and the stats commands say NumPy is missing.
+
+"""
+
+
+import array
+import logging
+import os
+import struct
+from typing import Any, Optional
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from storage import MAX_ATTEMPTS
+
+SEGMENT_ROWS = 4096
+COLUMNS = (
+    ('user_id', 'q'),
+    ('problem_id', 'i'),
+    ('attempt', 'B'),
+    ('correct', 'B'),
+    ('time', 'd'),
+    ('elapsed', 'f'),
+)
+RECORD = struct.Struct('<' + ''.join(typecode for _, typecode in COLUMNS))
+PERCENTILES = (25, 50, 90)
+
+
+class Segment:
+    """Up to SEGMENT_ROWS rows, one array per column. Full segments never change, so NumPy can view them without copying."""
+
+    def __init__(self, rows: Optional[list[tuple]] = None):
+        self.columns = {name: array.array(typecode) for name, typecode in COLUMNS}
+        for row in rows or ():
+            self.append(row)
+
+    def __len__(self) -> int:
+        return len(self.columns['user_id'])
+
+    def append(self, row: tuple) -> None:
+        for (name, _), value in zip(COLUMNS, row):
+            self.columns[name].append(value)
+
+
+class SubmissionHistory:
+    path: str
+    segments: list[Segment]  # the last one is the only one that is not full
+
+    def __init__(self, path: str):
+        self.path = path
+        self.segments = [Segment()]
+        self._file = None
+        self._dirty = False
+        self._sealed: tuple[int, dict[str, Any]] = (-1, {})  # (segment count, concatenated columns); -1 until built
+
+    def load(self) -> None:
+        data = b''
+        if os.path.exists(self.path):
+            with open(self.path, 'rb') as f:
+                data = f.read()
+        complete = len(data) - len(data) % RECORD.size
+        if complete != len(data):
+            logging.warning(f'{self.path}: dropping a torn record at offset {complete}')
+            with open(self.path, 'r+b') as f:
+                f.truncate(complete)
+        rows = list(RECORD.iter_unpack(data[:complete]))
+        self.segments = [Segment(rows[start:start + SEGMENT_ROWS]) for start in range(0, len(rows), SEGMENT_ROWS)]
+        if not self.segments or len(self.segments[-1]) == SEGMENT_ROWS:
+            self.segments.append(Segment())
+        self._sealed = (-1, {})
+        self._file = open(self.path, 'ab')
+        logging.info(f'loaded {len(rows)} submissions from {self.path}')
+
+    def __len__(self) -> int:
+        return (len(self.segments) - 1) * SEGMENT_ROWS + len(self.segments[-1])
+
+    def record(self, user_id: int, problem_id: int, attempt: int, correct: bool, timestamp: float, elapsed: float) -> None:
+        row = (user_id, problem_id, attempt, correct, timestamp, elapsed)
+        self.segments[-1].append(row)
+        if len(self.segments[-1]) == SEGMENT_ROWS:
+            self.segments.append(Segment())
+        self._file.write(RECORD.pack(*row))
+        self._file.flush()
+        self._dirty = True
+
+    def sync(self) -> None:
+        if self._dirty:
+            os.fsync(self._file.fileno())
+            self._dirty = False
+
+    def clear(self) -> None:
+        self._file.truncate(0)
+        self.segments = [Segment()]
+        self._sealed = (-1, {})
+
+    def close(self) -> None:
+        self.sync()
+        self._file.close()
+
+    def columns(self) -> dict[str, Any]:
+        """Returns every column as a NumPy array. Full segments are concatenated once and reused."""
+        sealed_count = len(self.segments) - 1
+        if self._sealed[0] != sealed_count:
+            self._sealed = (sealed_count, {
+                name: np.concatenate([np.frombuffer(segment.columns[name], dtype=typecode) for segment in self.segments[:-1]])
+                if sealed_count else np.empty(0, dtype=typecode)
+                for name, typecode in COLUMNS
+            })
+        sealed = self._sealed[1]
+        tail = self.segments[-1].columns
+        return {name: np.concatenate([sealed[name], np.array(tail[name], dtype=typecode)]) for name, typecode in COLUMNS}
+
+
+def read_columns(path: str) -> dict[str, Any]:
+    """Reads the history file at :path: as NumPy columns without opening it for writing (the bot may be appending)"""
+    dtype = np.dtype([(name, '<' + typecode) for name, typecode in COLUMNS])
+    with open(path, 'rb') as f:
+        data = f.read()
+    rows = np.frombuffer(data, dtype=dtype, count=len(data) // RECORD.size)
+    return {name: rows[name].astype(typecode) for name, typecode in COLUMNS}
+
+
+def problem_stats(columns: dict[str, Any], problem_id: int) -> dict[str, Any]:
+    """Submissions, solvers, solve rate, attempts needed and solve time percentiles for one problem"""
+    on_problem = columns['problem_id'] == problem_id
+    solved = on_problem & (columns['correct'] == 1)
+    solvers = int(np.count_nonzero(solved))
+    attempters = len(np.unique(columns['user_id'][on_problem]))
+    solve_times = columns['elapsed'][solved]
+    return {
+        'submissions': int(np.count_nonzero(on_problem)),
+        'attempters': attempters,
+        'solvers': solvers,
+        'solve_rate': solvers / attempters if attempters else 0.0,
+        'attempts': np.bincount(columns['attempt'][solved], minlength=MAX_ATTEMPTS + 1)[1:].tolist(),
+        'solve_time_percentiles': np.percentile(solve_times, PERCENTILES).tolist() if solvers else [],
+    }
+
+
+def difficulty(columns: dict[str, Any]) -> list[tuple[int, int, int, float, float]]:
+    """Returns (problem id, attempters, solvers, solve rate, mean attempts of solvers) for every problem, hardest first"""
+    if not len(columns['problem_id']):
+        return []
+    pairs = np.unique(np.stack([columns['problem_id'].astype(np.int64), columns['user_id']], axis=1), axis=0)
+    attempters = np.bincount(pairs[:, 0])
+    solved = columns['correct'] == 1
+    solvers = np.bincount(columns['problem_id'][solved], minlength=len(attempters))
+    attempt_sums = np.bincount(columns['problem_id'][solved], weights=columns['attempt'][solved], minlength=len(attempters))
+    problem_ids = np.flatnonzero(attempters)
+    solve_rates = solvers[problem_ids] / attempters[problem_ids]
+    mean_attempts = np.divide(attempt_sums[problem_ids], solvers[problem_ids],
+                              out=np.zeros(len(problem_ids)), where=solvers[problem_ids] > 0)
+    order = np.lexsort((-mean_attempts, solve_rates))
+    return [(int(problem_ids[i]), int(attempters[problem_ids[i]]), int(solvers[problem_ids[i]]),
+             float(solve_rates[i]), float(mean_attempts[i])) for i in order]
+
+
+def user_stats(columns: dict[str, Any], user_id: int, latest_problem_id: int) -> dict[str, Any]:
+    """Problems solved, attempts needed, median solve time and solve streaks of one user.
+
+    The current streak counts only if it reaches :latest_problem_id: or the problem before it.
+    """
+    by_user = columns['user_id'] == user_id
+    solved = by_user & (columns['correct'] == 1)
+    solved_ids = np.unique(columns['problem_id'][solved])
+    longest = current = 0
+    if len(solved_ids):
+        # Runs of consecutive problem ids
+        breaks = np.flatnonzero(np.diff(solved_ids) != 1)
+        run_lengths = np.diff(np.concatenate([[-1], breaks, [len(solved_ids) - 1]]))
+        longest = int(run_lengths.max())
+        if solved_ids[-1] >= latest_problem_id - 1:
+            current = int(run_lengths[-1])
+    return {
+        'attempted': len(np.unique(columns['problem_id'][by_user])),
+        'solved': len(solved_ids),
+        'attempts': np.bincount(columns['attempt'][solved], minlength=MAX_ATTEMPTS + 1)[1:].tolist(),
+        'median_solve_time': float(np.median(columns['elapsed'][solved])) if len(solved_ids) else None,
+        'longest_streak': longest,
+        'current_streak': current,
+    }
@@ -6,31 +6,48 @@ OMMC PROBLEM OF THE DAY BOT
 
 
 import asyncio
+import bisect
+import collections
+import contextlib
 import datetime
+import io
 import json
 import logging
 import math
-import pickle
-import re
+import mimetypes
 import signal
 import sys
 import time
-from typing import Any
+from typing import Any, AsyncIterator, Awaitable, Callable, Iterable, Mapping, Optional
 
 import discord
 from discord.ext import commands, tasks
 
-SHARES = [
-    0,
-    0.15,  # 1 attempt left
-    0.35,
-    0.55,
-    0.75,
-    1.0,  # 5 attempts (first try)
-]
+import console
+import history
+import metrics
+import scoring
+from answers import ANSWER_PARSERS, AnswerError, parse_answer, validate_answer
+from problembank import ProblemIndex, detect_format, import_ops, load_problem_set
+from scoring import SHARES
+from storage import MAX_ATTEMPTS, Op, RankIndex, Storage, get_default_attempt, get_default_user_data, make_storage
+
 HOUR_OF_RESET = 22
 TIMEDELTA = datetime.timedelta(days=1.0)
 LEAD_PAGE_SIZE = 10
+DM_CONCURRENCY = 10  # DMs go to different channels, so only the global rate limit applies
+ROLE_CONCURRENCY = 2  # role edits in one guild share a rate limit bucket
+DISPATCH_RETRIES = 3
+LOOKUP_TTL = 300.0  # seconds a REST-fetched guild or member is reused
+MAX_SCHEDULER_SLEEP = 3600.0  # re-read the wall clock at least this often
+STAGE_LEAD = 600.0  # seconds before a reset that the next post is prepared
+IMAGE_TIMEOUT = 20.0
+MAX_IMAGE_BYTES = 8 * 1024 * 1024  # Discord's upload limit for bots
+IMAGE_CHUNK = 64 * 1024
+IMPORT_ERRORS_SHOWN = 20
+RENDER_CACHE_SIZE = 1024  # rendered leaderboard pages, rank cards and problem statuses
+USER_RATE = (5, 0.5)  # burst and messages per second a user may send to the bot
+GUILD_RATE = (30, 5.0)  # burst and commands per second in one guild
 POINTS_TO_EACH_STAR = [0, 100, 250, 450, 700, 1000, 1300, 1600, 1900, 2200, 2500, 25000, 250000]
 STARS = ['⭑', '★', '✬', '✰', '✶', '✵', '✭', '✪', '✸', '✦', '❂', '❂❂', '❂❂❂']
 
@@ -38,188 +55,970 @@ STARS = ['⭑', '★', '✬', '✰', '✶', '✵', '✭', '✪', '✸', '✦', '
 discord.utils.setup_logging()
 
 
-def get_default_user_data() -> dict[str, Any]:
-    return {
-        'answered': False,
-        'attemptsleft': 5,
-        'totalscore': 0,
-    }
-
-
-def get_star(points: int) -> str:
-    """Returns the star character for some number of points."""
-    for i, points_needed in enumerate(POINTS_TO_EACH_STAR):
-        if points < points_needed:
-            return STARS[i-1]
-    return STARS[-1]
-
-
-def get_next_index(points: int) -> int:
-    """Returns the next star index some number of points."""
-    for i, points_needed in enumerate(POINTS_TO_EACH_STAR):
-        if points < points_needed:
-            return i
-    return None
-
-
-def validate_answer(answer: str, answerformat: str) -> tuple[bool, str]:
-    """Validates :answer: to :answerformat:. Returns a tuple[success or not, message if failed]"""
-    if answerformat == 'integer':
-        if re.match(r'^(-?[1-9]\d*|0)$', answer) is None:
-            return False, 'This is an invalid integer. Enter an integer, like `10` or `-2`.'
-        return True, ''
-    if answerformat == 'fraction':
-        match = re.match(r'^-?([1-9]\d*)/([1-9]\d*)$', answer)
-        if match is None:
-            return False, 'This is an invalid fraction. Enter `m/n` or `-m/n` where `m` and `n` are positive integers, like `5/3` or `-1/2`.'
-        numerator = int(match.group(1))
-        denominator = int(match.group(2))
-        if numerator > 1_000_000 or denominator > 1_000_000:
-            return False, 'Fraction too large!'
-        if math.gcd(numerator, denominator) != 1:
-            return False, 'This fraction is not simplified.'
-        return True, ''
-    if answerformat == 'string':
-        return True, ''
-    return False, 'Invalid answer format supplied by the problem. Contact admin.'
-
-
-def calculate_problem_value(share_count: float) -> float:
-    """Calculates the value of a problem with :share_count: shares."""
-    return 3000.0 / (6.0 + share_count)
+class StarTiers:
+    """Star tiers by minimum points. Lookups are a bisect over the thresholds."""
+
+    thresholds: list[int]
+    stars: list[str]
+
+    def __init__(self, tiers: Iterable[tuple[int, str]]):
+        tiers = sorted(tiers)
+        if not tiers:
+            raise ValueError('at least one star tier is required')
+        self.thresholds = [points for points, _ in tiers]
+        self.stars = [star for _, star in tiers]
+
+    @classmethod
+    def from_config(cls, config: dict[str, Any]) -> 'StarTiers':
+        """Reads tiers from the optional `stars` config key: a list of [points, star] pairs"""
+        return cls(config.get('stars', zip(POINTS_TO_EACH_STAR, STARS)))
+
+    def _index(self, points: int) -> int:
+        return max(bisect.bisect_right(self.thresholds, points) - 1, 0)
+
+    def star(self, points: int) -> str:
+        """Returns the star character for some number of points."""
+        return self.stars[self._index(points)]
+
+    def lookup(self, points: int) -> tuple[str, Optional[str], Optional[int]]:
+        """Returns (star, next star, points needed for the next star). The last two are None at the top tier."""
+        i = self._index(points)
+        if i + 1 == len(self.stars):
+            return self.stars[i], None, None
+        return self.stars[i], self.stars[i + 1], self.thresholds[i + 1] - points
+
+    def histogram(self, rank_index: 'RankIndex') -> list[tuple[str, int]]:
+        """Returns (star, number of users) for each tier"""
+        at_least = [rank_index.count_at_least(points) for points in self.thresholds[1:]]
+        counts = [len(rank_index) - (at_least[0] if at_least else 0)]
+        counts += [count - next_count for count, next_count in zip(at_least, at_least[1:] + [0])]
+        return list(zip(self.stars, counts))
+
+
+def format_duration(seconds: float) -> str:
+    """Formats :seconds: like `3h 05m` or `42s`"""
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    if hours:
+        return f'{hours}h {minutes:02d}m'
+    if minutes:
+        return f'{minutes}m {seconds:02d}s'
+    return f'{seconds}s'
+
+
+def format_attempts(counts: list[int]) -> str:
+    """Formats solves by attempt number like `1st: **5** / 2nd: **2** / ...`"""
+    return ' / '.join(f'{ordinal}: **{count}**' for ordinal, count in zip(('1st', '2nd', '3rd', '4th', '5th'), counts))
+
+
+class Dispatcher:
+    """Runs a batch of Discord requests with bounded concurrency.
+
+    Requests that share a rate limit bucket should go in the same dispatcher, with the
+    concurrency sized to that bucket; discord.py waits out 429s itself. Failed requests
+    are retried with exponential backoff, except for Forbidden and NotFound. Any other
+    exception fails only its own job.
+    """
+
+    name: str
+    concurrency: int
+
+    def __init__(self, name: str, concurrency: int):
+        self.name = name
+        self.concurrency = concurrency
+        self._jobs: list[tuple[str, Callable[[], Awaitable[Any]]]] = []
+
+    def add(self, description: str, job: Callable[[], Awaitable[Any]]) -> None:
+        """Queues :job:, a function returning a new awaitable for each try"""
+        self._jobs.append((description, job))
+
+    async def _run_job(self, description: str, job: Callable[[], Awaitable[Any]]) -> bool:
+        for attempt in range(DISPATCH_RETRIES):
+            try:
+                await job()
+                return True
+            except (discord.errors.Forbidden, discord.errors.NotFound) as e:
+                logging.warning(f'{self.name}: {description} failed: {e}')
+                return False
+            except (discord.errors.HTTPException, OSError, asyncio.TimeoutError) as e:
+                logging.warning(f'{self.name}: {description} failed (try {attempt + 1}/{DISPATCH_RETRIES}): {e}')
+                if attempt + 1 < DISPATCH_RETRIES:
+                    await asyncio.sleep(2 ** attempt)
+            except Exception:
+                # A bug in one job must not abort the whole batch
+                logging.exception(f'{self.name}: {description} failed')
+                return False
+        return False
+
+    async def run(self) -> tuple[int, int]:
+        """Runs all queued jobs. Returns (succeeded, failed)."""
+        jobs, self._jobs = self._jobs, []
+        semaphore = asyncio.Semaphore(self.concurrency)
+        progress_step = max(len(jobs) // 10, 1)
+        succeeded = failed = 0
+
+        async def worker(description: str, job: Callable[[], Awaitable[Any]]) -> None:
+            nonlocal succeeded, failed
+            async with semaphore:
+                if await self._run_job(description, job):
+                    succeeded += 1
+                else:
+                    failed += 1
+            if (succeeded + failed) % progress_step == 0:
+                logging.info(f'{self.name}: {succeeded + failed}/{len(jobs)} done ({failed} failed)')
+
+        start = time.perf_counter()
+        await asyncio.gather(*(worker(description, job) for description, job in jobs))
+        elapsed = time.perf_counter() - start
+        logging.info(f'{self.name}: finished {len(jobs)} jobs in {elapsed:.1f}s ({failed} failed)')
+        metrics.dispatch_seconds.observe(elapsed, dispatcher=self.name)
+        metrics.dispatch_jobs.inc(succeeded, dispatcher=self.name, outcome='succeeded')
+        metrics.dispatch_jobs.inc(failed, dispatcher=self.name, outcome='failed')
+        return succeeded, failed
+
+
+class TTLCache:
+    """Dict whose entries expire :ttl: seconds after being set"""
+
+    def __init__(self, ttl: float):
+        self.ttl = ttl
+        self._entries: dict[Any, tuple[float, Any]] = {}
+
+    def get(self, key: Any) -> Any:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires, value = entry
+        if time.monotonic() >= expires:
+            del self._entries[key]
+            return None
+        return value
+
+    def set(self, key: Any, value: Any) -> None:
+        self._entries[key] = (time.monotonic() + self.ttl, value)
+
+    def pop(self, key: Any) -> None:
+        self._entries.pop(key, None)
+
+
+class RenderCache:
+    """LRU cache of rendered command output.
+
+    Keys carry the epoch of the data a view was rendered from, so a mutation makes
+    the old entries unreachable and they are evicted as new ones come in.
+    """
+
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self._entries: collections.OrderedDict[tuple, Any] = collections.OrderedDict()
+
+    def get(self, key: tuple, render: Callable[[], Any]) -> Any:
+        """Returns the entry for :key:, calling :render: to create it on a miss. key[0] names the view."""
+        try:
+            self._entries.move_to_end(key)
+        except KeyError:
+            metrics.render_cache.inc(view=key[0], outcome='miss')
+            value = self._entries[key] = render()
+            if len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+            return value
+        metrics.render_cache.inc(view=key[0], outcome='hit')
+        return self._entries[key]
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+
+class Lookup:
+    """Resolves guilds, roles, members and channels.
+
+    The gateway cache is tried first, then a TTL cache of REST results, and REST
+    only on a miss. Gateway events about a guild, role, member or channel drop its cached entry.
+    """
+
+    client: commands.Bot
+
+    def __init__(self, client: commands.Bot):
+        self.client = client
+        self._guilds = TTLCache(LOOKUP_TTL)
+        self._members = TTLCache(LOOKUP_TTL)
+        self._channels = TTLCache(LOOKUP_TTL)
+
+    def register(self) -> None:
+        """Subscribes to the gateway events that invalidate cached entries"""
+        self.client.add_listener(self.on_guild_update)
+        self.client.add_listener(self.on_guild_remove)
+        self.client.add_listener(self.on_guild_role_update)
+        self.client.add_listener(self.on_guild_role_delete)
+        self.client.add_listener(self.on_member_update)
+        self.client.add_listener(self.on_member_remove)
+        self.client.add_listener(self.on_guild_channel_update)
+        self.client.add_listener(self.on_guild_channel_delete)
+
+    async def guild(self, guild_id: int) -> Optional[discord.Guild]:
+        guild = self.client.get_guild(guild_id) or self._guilds.get(guild_id)
+        if guild is None:
+            try:
+                guild = await self.client.fetch_guild(guild_id)
+            except (discord.errors.Forbidden, discord.errors.NotFound):
+                logging.warning(f'Could not fetch guild ID {guild_id}')
+                return None
+            self._guilds.set(guild_id, guild)
+        return guild
+
+    async def role(self, guild_id: int, role_id: int) -> Optional[discord.Role]:
+        guild = await self.guild(guild_id)
+        return None if guild is None else guild.get_role(role_id)
+
+    async def member(self, guild: discord.Guild, user_id: int) -> Optional[discord.Member]:
+        member = guild.get_member(user_id) or self._members.get((guild.id, user_id))
+        if member is None:
+            try:
+                member = await guild.fetch_member(user_id)
+            except (discord.errors.Forbidden, discord.errors.NotFound):
+                return None
+            self._members.set((guild.id, user_id), member)
+        return member
+
+    async def channel(self, channel_id: int) -> Optional[discord.abc.GuildChannel]:
+        channel = self.client.get_channel(channel_id) or self._channels.get(channel_id)
+        if channel is None:
+            try:
+                channel = await self.client.fetch_channel(channel_id)
+            except (discord.errors.Forbidden, discord.errors.NotFound):
+                logging.warning(f'Could not fetch channel ID {channel_id}')
+                return None
+            self._channels.set(channel_id, channel)
+        return channel
+
+    #
+
+    async def on_guild_update(self, before: discord.Guild, after: discord.Guild) -> None:
+        self._guilds.pop(after.id)
+
+    async def on_guild_remove(self, guild: discord.Guild) -> None:
+        self._guilds.pop(guild.id)
+
+    async def on_guild_role_update(self, before: discord.Role, after: discord.Role) -> None:
+        self._guilds.pop(after.guild.id)
+
+    async def on_guild_role_delete(self, role: discord.Role) -> None:
+        self._guilds.pop(role.guild.id)
+
+    async def on_member_update(self, before: discord.Member, after: discord.Member) -> None:
+        self._members.pop((after.guild.id, after.id))
+
+    async def on_member_remove(self, member: discord.Member) -> None:
+        self._members.pop((member.guild.id, member.id))
+
+    async def on_guild_channel_update(self, before: discord.abc.GuildChannel, after: discord.abc.GuildChannel) -> None:
+        self._channels.pop(after.id)
+
+    async def on_guild_channel_delete(self, channel: discord.abc.GuildChannel) -> None:
+        self._channels.pop(channel.id)
+
+
+async def fetch_image(url: str) -> tuple[Optional[bytes], str]:
+    """Downloads the image at :url:. Returns (image, content type), or (None, what is wrong with it)."""
+    import aiohttp  # installed with discord.py
+
+    try:
+        async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=IMAGE_TIMEOUT)) as session:
+            async with session.get(url) as response:
+                if response.status != 200:
+                    return None, f'HTTP {response.status}'
+                if not response.content_type.startswith('image/'):
+                    return None, f'not an image ({response.content_type})'
+                if (response.content_length or 0) > MAX_IMAGE_BYTES:
+                    return None, f'too large ({response.content_length} bytes)'
+                # Content-Length is missing on chunked responses, so never read more than the limit
+                image = bytearray()
+                async for chunk in response.content.iter_chunked(IMAGE_CHUNK):
+                    image += chunk
+                    if len(image) > MAX_IMAGE_BYTES:
+                        return None, f'too large (over {MAX_IMAGE_BYTES} bytes)'
+                return bytes(image), response.content_type
+    except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as e:
+        return None, f'{type(e).__name__}: {e}'
+
+
+class StagedPost:
+    """A problem post prepared ahead of its reset, so posting it is one send per channel"""
+
+    key: tuple  # what the post was built from; see Main.post_key
+    channels: list[discord.abc.Messageable]
+    embed: discord.Embed
+    image: Optional[bytes]  # uploaded as an attachment if set
+    image_filename: str
+    image_error: Optional[str]
+
+    def __init__(self, key: tuple, channels: list[discord.abc.Messageable], embed: discord.Embed,
+                 image: Optional[bytes] = None, image_filename: str = '', image_error: Optional[str] = None):
+        self.key = key
+        self.channels = channels
+        self.embed = embed
+        self.image = image
+        self.image_filename = image_filename
+        self.image_error = image_error
+
+    def send_kwargs(self) -> dict[str, Any]:
+        """Arguments for channel.send. A new discord.File is needed for every send."""
+        if self.image is None:
+            return {'embed': self.embed}
+        return {'embed': self.embed, 'file': discord.File(io.BytesIO(self.image), filename=self.image_filename)}
+
+
+class KeyedLock:
+    """One asyncio.Lock per key. A key's lock is dropped once nobody holds or waits for it."""
+
+    def __init__(self):
+        self._locks: dict[Any, tuple[asyncio.Lock, int]] = {}
+
+    @contextlib.asynccontextmanager
+    async def __call__(self, key: Any) -> AsyncIterator[None]:
+        lock, users = self._locks.get(key, (None, 0))
+        if lock is None:
+            lock = asyncio.Lock()
+        self._locks[key] = (lock, users + 1)
+        try:
+            async with lock:
+                yield
+        finally:
+            lock, users = self._locks[key]
+            if users == 1:
+                del self._locks[key]
+            else:
+                self._locks[key] = (lock, users - 1)
+
+
+class TokenBuckets:
+    """One token bucket per key, refilled continuously. A key is allowed :capacity: actions at once and :rate: per second after that.
+
+    Full buckets are indistinguishable from missing ones, so they are dropped once there are many keys.
+    """
+
+    def __init__(self, capacity: float, rate: float, max_keys: int = 10000):
+        self.capacity = capacity
+        self.rate = rate
+        self.max_keys = max_keys
+        self._buckets: dict[Any, tuple[float, float]] = {}  # key -> (tokens, time of last update)
+
+    def take(self, key: Any) -> bool:
+        """Takes a token from :key:'s bucket. Returns False if it is empty."""
+        now = time.monotonic()
+        tokens, updated = self._buckets.get(key, (self.capacity, now))
+        tokens = min(self.capacity, tokens + (now - updated) * self.rate)
+        allowed = tokens >= 1.0
+        self._buckets[key] = (tokens - 1.0 if allowed else tokens, now)
+        if len(self._buckets) > self.max_keys:
+            self._prune(now)
+        return allowed
+
+    def _prune(self, now: float) -> None:
+        self._buckets = {key: (tokens, updated) for key, (tokens, updated) in self._buckets.items()
+                         if tokens + (now - updated) * self.rate < self.capacity}
+
+
+class ResetScheduler:
+    """Sleeps until the current problem's deadline, then moves to the next problem.
+    STAGE_LEAD seconds before the deadline it has the next post prepared.
+
+    The deadline is computed once per sleep. Anything that can move it (state or
+    problem changes) calls reschedule(), which wakes the scheduler to recompute.
+    """
+
+    main: 'Main'
+
+    def __init__(self, main: 'Main'):
+        self.main = main
+        self._wake = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self) -> None:
+        self._task = asyncio.create_task(self._run())
+
+    def reschedule(self) -> None:
+        self._wake.set()
+
+    async def _sleep(self, seconds: float) -> bool:
+        """Sleeps for :seconds:. Returns False if woken early by reschedule()."""
+        try:
+            await asyncio.wait_for(self._wake.wait(), seconds)
+            return False
+        except asyncio.TimeoutError:
+            return True
+
+    async def _run(self) -> None:
+        while True:
+            self._wake.clear()
+            if not self.main.is_current_problem():
+                await self._wake.wait()
+                continue
+            problem_id = self.main.state['currentproblemid']
+            deadline = self.main.get_deadline()
+            delay = (deadline - datetime.datetime.now()).total_seconds()
+            if delay > 0:
+                if delay <= STAGE_LEAD and not self.main.is_next_post_staged():
+                    try:
+                        await self.main.stage_next_post()
+                    except Exception:
+                        logging.exception(f'{self.main.name} scheduler: staging the next post failed')
+                        await self._sleep(min(delay, 60.0))
+                    continue
+                logging.info(f'{self.main.name} scheduler: next reset at {deadline} (in {delay:.0f}s)')
+                # Long sleeps are split up so clock changes or suspends cannot make the reset late
+                await self._sleep(min(delay - STAGE_LEAD if delay > STAGE_LEAD else delay, MAX_SCHEDULER_SLEEP))
+                continue
+            logging.info(f'{self.main.name} scheduler: Problem expired!')
+            try:
+                await self.main.next_problem(problem_id)
+            except Exception:
+                logging.exception(f'{self.main.name} scheduler: next_problem failed')
+                await self._sleep(60.0)
 
 
 class Main:
     client: commands.Bot
 
+    name: str
+    lookup: Lookup
+    scheduler: ResetScheduler
+    transition_lock: asyncio.Lock
+    user_locks: KeyedLock
+    role_grants: asyncio.Queue
+    _parsed_answers: dict[int, Any]
+    problem_index: ProblemIndex
+
     config: dict[str, Any]
-    _data: dict[str, Any]
+    star_tiers: StarTiers
+    storage: Storage
+    history: history.SubmissionHistory
+    staged_post: Optional[StagedPost]
+    rank_index: RankIndex
+    solve_counts: list[int]  # solvers of the current problem by attempts left
+    renders: RenderCache
+    score_epoch: int  # bumped whenever a score or the set of ranked users changes
+    solve_epoch: int  # bumped whenever solve_counts changes
 
     @property
     def problems(self) -> list[dict[str, Any]]:
-        return self._data['problems']
+        return self.storage.problems
+    @property
+    def users(self) -> Mapping[int, dict[str, Any]]:
+        """Read-only view of the users. Use update_user to make changes."""
+        return self.storage.users
     @property
-    def users(self) -> dict[int, dict[str, Any]]:
-        return self._data['users']
+    def attempts(self) -> dict[int, dict[str, Any]]:
+        """Attempts on the current problem by user. Use update_attempt to make changes."""
+        return self.storage.attempts
     @property
     def state(self) -> dict[str, Any]:
-        return self._data['state']
+        return self.storage.state
+    @property
+    def total_shares(self) -> float:
+        return scoring.share_total(self.solve_counts)
+    @property
+    def solver_count(self) -> int:
+        return sum(self.solve_counts)
 
     def load_data(self) -> None:
-        """Loads config & data from storage"""
-        with open('config.json', 'r') as f:
-            self.config = json.load(f)
-        try:
-            with open('data.pickle', 'rb') as f:
-                self._data = pickle.load(f)
-        except FileNotFoundError:
-            self._data = {
-                'problems': [],
-                'users': {},
-                'state': {
-                    'currentproblemid': 0,
-                    'lastreset': [1970, 1, 1],  # year, month, day, hour (in UTC)
-                },
-            }
+        """Loads data from storage"""
+        self.star_tiers = StarTiers.from_config(self.config)
+        self.storage = make_storage(self.config)
+        self.storage.load()
+        self.history = history.SubmissionHistory(f'{self.config.get("datafile", "data")}.history')
+        self.history.load()
+        self.rank_index = self.storage.rank_index()
+        self._parsed_answers = {}
+        self.problem_index = ProblemIndex(self.problems)
+        self.renders = RenderCache(RENDER_CACHE_SIZE)
+        self.score_epoch = 0
+        self.solve_epoch = 0
+        self.count_solves()
 
     def save_data(self) -> None:
-        """Saves data to storage"""
-        with open('data.pickle', 'wb') as f:
-            pickle.dump(self._data, f)
-        logging.info('data successfully saved')
+        """Writes a full snapshot to storage and empties the journal"""
+        with metrics.save_seconds.time(season=self.name):
+            size = self.storage.snapshot()
+        metrics.save_bytes.set(size, season=self.name)
+        logging.info(f'{self.name}: data successfully saved')
+
+    def commit(self, op: Op) -> None:
+        """Applies a mutation to the data and journals it. All writes to users, problems and state go through here."""
+        self.storage.commit(op)
+        self._committed(op)
+
+    def _committed(self, op: Op) -> None:
+        """Updates the indexes and epochs after :op: was committed"""
+        if op[0] == 'batch':
+            for batch_op in op[1]:
+                self._committed(batch_op)
+        elif op[0] == 'user':
+            _, user_id, fields = op
+            if 'totalscore' in fields:
+                self.rank_index.update(user_id, fields['totalscore'])
+                self.score_epoch += 1
+            elif self.rank_index.rank(user_id) is None:
+                self.rank_index.update(user_id, self.users[user_id]['totalscore'])
+                self.score_epoch += 1
+        elif op[0] == 'users' and 'totalscore' in op[1]:
+            self.rank_index = self.storage.rank_index()
+            self.score_epoch += 1
+        elif op[0] == 'attempt' and op[2].get('answered'):
+            self.solve_epoch += 1
+        elif op[0] == 'clearattempts':
+            self.count_solves()
+            self.solve_epoch += 1
+        elif op[0] in ('problem', 'problems', 'clearproblems'):
+            if op[0] == 'problem':
+                self.problem_index.set(op[1], op[2])
+            elif op[0] == 'problems':
+                for problem_id, problem in enumerate(op[2], start=op[1]):
+                    self.problem_index.set(problem_id, problem)
+            else:
+                self.problem_index.rebuild(())
+            self._parsed_answers.clear()
+            self.scheduler.reschedule()
+        elif op[0] == 'state':
+            self.scheduler.reschedule()
 
-    def termination_handler(self, signal, frame):
-        """Handles SIGINT and SIGTERM"""
-        logging.info('exiting')
-        self.save_data()
-        sys.exit(0)
+    def update_user(self, user_id: int, **fields) -> None:
+        self.commit(('user', user_id, fields))
 
-    def __init__(self):
+    def update_attempt(self, user_id: int, **fields) -> None:
+        self.commit(('attempt', user_id, fields))
+
+    def count_solves(self) -> None:
+        """Recomputes solve_counts from the attempts"""
+        self.solve_counts = [0] * (MAX_ATTEMPTS + 1)
+        for attempt in self.attempts.values():
+            if attempt['answered']:
+                self.solve_counts[attempt['attemptsleft']] += 1
+
+    def update_state(self, **fields) -> None:
+        self.commit(('state', fields))
+
+    def close(self) -> None:
+        self.save_data()
+        self.storage.close()
+        self.history.close()
+
+    def __init__(self, client: commands.Bot, lookup: Lookup, config: dict[str, Any]):
+        """One season: a problem set played in one guild, with its own users, storage and schedule.
+        :config: is the season's entry from get_season_configs.
+        """
+        self.client = client
+        self.lookup = lookup
+        self.config = config
+        self.name = config['name']
         self.load_data()
-        intents = discord.Intents.default()
-        intents.members = True
-        intents.message_content = True
-        self.client = commands.Bot(command_prefix=self.config['prefix'], intents=intents)
-        self.client.remove_command('help')
-        self.client.event(self.on_ready)
-        self.client.event(self.on_command_error)
-        self.client.event(self.on_message)
+        self.scheduler = ResetScheduler(self)
+        self.staged_post = None
+        self.transition_lock = asyncio.Lock()
+        self.user_locks = KeyedLock()
+        self.role_grants = asyncio.Queue()
+
+    def start(self) -> None:
+        """Starts the journal sync, the reset schedule and the role grant workers"""
+        self.sync_journal.start()
+        self.scheduler.start()
+        for _ in range(ROLE_CONCURRENCY):
+            asyncio.create_task(self.role_grant_worker())
 
     #
 
-    @tasks.loop(seconds=20.0)
-    async def check_time(self) -> None:
-        """Checks if the current problem has expired"""
-        if not self.is_current_problem():
-            return
-        now = datetime.datetime.now()
-        if now >= self.get_last_reset_time() + TIMEDELTA:
-            logging.info('check_time: Problem expired!')
-            await self.next_problem()
-
-    async def post_question(self) -> None:
-        problem_channel = await self.client.fetch_channel(self.config['problemchannel'])
-        new_problem = self.problems[self.state["currentproblemid"]]
-        timestamp = int((self.get_last_reset_time() + TIMEDELTA).timestamp())
+    @tasks.loop(seconds=1.0)
+    async def sync_journal(self) -> None:
+        """fsyncs journal records and submissions appended since the last tick"""
+        self.storage.sync()
+        self.history.sync()
+
+    def post_key(self, problem_id: int, close_time: datetime.datetime) -> tuple:
+        """Everything a post depends on. A staged post is only used if its key still matches."""
+        problem = self.problems[problem_id]
+        return problem_id, int(close_time.timestamp()), problem['imageurl'], problem['answerformat']
+
+    def next_post(self) -> Optional[tuple[int, datetime.datetime]]:
+        """Returns (problem id, close time) of the problem posted at the next reset, if there is one"""
+        problem_id = self.state['currentproblemid'] + 1
+        if problem_id >= len(self.problems):
+            return None
+        opened = datetime.datetime(*self.get_deadline().timetuple()[:3], HOUR_OF_RESET)
+        return problem_id, self._close_time(opened, problem_id)
+
+    def is_next_post_staged(self) -> bool:
+        next_post = self.next_post()
+        return next_post is None or (self.staged_post is not None and self.staged_post.key == self.post_key(*next_post))
+
+    async def stage_next_post(self) -> None:
+        next_post = self.next_post()
+        if next_post is not None:
+            self.staged_post = await self.stage_post(*next_post, self.get_deadline())
+
+    async def stage_post(self, problem_id: int, close_time: datetime.datetime, post_time: datetime.datetime) -> StagedPost:
+        """Resolves the channels, builds the embed and checks (and optionally downloads) the image of a post.
+
+        Problems are warned about in the `staffchannel`, if configured, saying the post goes out at :post_time:.
+        """
+        problem = self.problems[problem_id]
+        key = self.post_key(problem_id, close_time)
+        channel_ids = [self.config['problemchannel'], *self.config.get('announcechannels', [])]
+        channels = [channel for channel in await asyncio.gather(*map(self.lookup.channel, channel_ids)) if channel is not None]
         embed = discord.Embed(title='Problem of the Day',
-                              description=f'Closes <t:{timestamp}:R>\nAnswer format: `{new_problem["answerformat"]}`')
-        embed.set_image(url=new_problem['imageurl'])
-        await problem_channel.send(embed=embed)
-
-    async def next_problem(self) -> None:
-        """Gives points for the current problem and moves to the next."""
-        if not self.is_current_problem():
-            logging.warning('next_problem was called while no problem was active')
-            return
-
-        guild = await self.client.fetch_guild(self.config['guildid'])
-        role = None if guild is None else guild.get_role(self.config['solvedrole'])
-
-        total_shares = sum(SHARES[user_data['attemptsleft']] for user_data in self.users.values() if user_data['answered'])
-        logging.info(f'total shares is {total_shares}')
-        score_per_share = calculate_problem_value(total_shares)
-        logging.info(f'score per share is {score_per_share}')
-        for user_id, user_data in self.users.items():
-            if user_data['answered']:
-                score = int(score_per_share * SHARES[user_data['attemptsleft']])
-                user_data['totalscore'] += score
-                user = self.client.get_user(user_id)
-                if user is not None:
-                    try:
-                        await user.send(f'You earned **{score}** points for this problem!\n'
-                                        f'Your total score is now **{user_data["totalscore"]}** points.'
-                                        )
-                    except discord.errors.Forbidden:
-                        logging.warning(f'Could not send DM to user ID {user_id}')
-                if role is not None:
-                    member = await guild.fetch_member(user_id)
-                    if member is not None:
-                        await member.remove_roles(role)
-                    else:
-                        logging.warning(f'Could not remove role from user ID {user_id} because member is None')
-        for userdata in self.users.values():
-            userdata['answered'] = False
-            userdata['attemptsleft'] = 5
-
-        self.state['currentproblemid'] += 1
-        self.state['lastreset'] = datetime.datetime.now().timetuple()[:3]  # Y, M, D
+                              description=f'Closes <t:{key[1]}:R>\nAnswer format: `{problem["answerformat"]}`')
+        embed.set_image(url=problem['imageurl'])
+        staged = StagedPost(key, channels, embed)
+        if self.config.get('checkimages', True):
+            image, detail = await fetch_image(problem['imageurl'])
+            if image is None:
+                staged.image_error = detail
+            elif self.config.get('uploadimages', False):
+                staged.image = image
+                staged.image_filename = f'problem{problem_id}{mimetypes.guess_extension(detail) or ".png"}'
+                embed.set_image(url=f'attachment://{staged.image_filename}')
+
+        warnings = []
+        if len(channels) < len(channel_ids):
+            warnings.append(f'{len(channel_ids) - len(channels)} of {len(channel_ids)} channels could not be fetched')
+        if staged.image_error is not None:
+            warnings.append(f'its image {problem["imageurl"]} could not be loaded ({staged.image_error})')
+        logging.info(f'{self.name}: staged problem #{problem_id} for {len(channels)} channels')
+        if warnings:
+            logging.warning(f'{self.name}: problem #{problem_id}: {"; ".join(warnings)}')
+            staff_channel = None if 'staffchannel' not in self.config else await self.lookup.channel(self.config['staffchannel'])
+            if staff_channel is not None:
+                await staff_channel.send(f'**Warning:** problem #{problem_id} is posted <t:{int(post_time.timestamp())}:R>, '
+                                         f'but {" and ".join(warnings)}.')
+        return staged
 
+    async def post_question(self) -> None:
+        """Posts the current problem to every channel, using the staged post if it is still up to date"""
+        key = self.post_key(self.state['currentproblemid'], self.get_deadline())
+        if self.staged_post is not None and self.staged_post.key == key:
+            staged, self.staged_post = self.staged_post, None
+        else:
+            # A staged post for another problem (e.g. the next one, when reposting) is kept for its own reset
+            staged = await self.stage_post(self.state['currentproblemid'], self.get_deadline(), datetime.datetime.now())
+        with metrics.post_seconds.time(season=self.name):
+            results = await asyncio.gather(*(channel.send(**staged.send_kwargs()) for channel in staged.channels),
+                                           return_exceptions=True)
+        for channel, result in zip(staged.channels, results):
+            if isinstance(result, Exception):
+                logging.error(f'{self.name}: could not post to channel ID {channel.id}', exc_info=result)
+
+    async def next_problem(self, problem_id: int) -> None:
+        """Gives points for problem :problem_id: and moves to the next. Only one transition runs at a time,
+        and nothing happens if :problem_id: is no longer current once this one gets its turn.
+        """
+        async with self.transition_lock:
+            if problem_id != self.state['currentproblemid']:
+                logging.info(f'{self.name}: problem #{problem_id} was already closed')
+                return
+            with metrics.next_problem_seconds.time(season=self.name):
+                await self._next_problem()
+
+    async def _next_problem(self) -> None:
         if not self.is_current_problem():
-            logging.warning('No more problems!')
+            logging.warning(f'{self.name}: next_problem was called while no problem was active')
             return
-        await self.post_question()
+
+        # Commit all scores, the cleared attempts and the new state as one operation before
+        # any network I/O, so a crash or a second call cannot award points twice
+        logging.info(f'{self.name}: total shares is {self.total_shares}')
+        logging.info(f'{self.name}: score per share is {scoring.problem_value(self.total_shares)}')
+        award_table = scoring.award_table(self.solve_counts)
+        awards = []
+        for user_id, attempt in self.attempts.items():
+            if attempt['answered']:
+                score = int(award_table[attempt['attemptsleft']])
+                totalscore = self.users[user_id]['totalscore'] + score
+                awards.append((user_id, score, totalscore))
+        self.commit(('batch', [
+            *(('user', user_id, {'totalscore': totalscore}) for user_id, score, totalscore in awards),
+            ('clearattempts',),
+            ('state', {'currentproblemid': self.state['currentproblemid'] + 1,
+                       'lastreset': datetime.datetime.now().timetuple()[:3]}),  # Y, M, D
+        ]))
+        self.save_data()
+
+        role = await self.lookup.role(self.config['guildid'], self.config['solvedrole'])
+        dms = Dispatcher(f'{self.name} score DMs', DM_CONCURRENCY)
+        role_removals = Dispatcher(f'{self.name} role removal', ROLE_CONCURRENCY)
+        for user_id, score, totalscore in awards:
+            user = self.client.get_user(user_id)
+            if user is not None:
+                dms.add(f'DM to user ID {user_id}',
+                        lambda user=user, score=score, totalscore=totalscore: user.send(
+                            f'You earned **{score}** points for this problem!\n'
+                            f'Your total score is now **{totalscore}** points.'
+                        ))
+            if role is not None:
+                async def remove_role(user_id=user_id) -> None:
+                    member = await self.lookup.member(role.guild, user_id)
+                    if member is None:
+                        logging.info(f'{self.name}: user ID {user_id} left the guild, no role to remove')
+                        return
+                    await member.remove_roles(role)
+                role_removals.add(f'role removal from user ID {user_id}', remove_role)
+
+        # DMs keep going while the roles are cleared and the next problem is posted
+        dm_task = asyncio.create_task(dms.run())
+        try:
+            await role_removals.run()
+            if not self.is_current_problem():
+                logging.warning(f'{self.name}: No more problems!')
+            else:
+                await self.post_question()
+        finally:
+            await dm_task
 
     #
 
     def get_last_reset_time(self) -> datetime.datetime:
         return datetime.datetime(*self.state['lastreset'], HOUR_OF_RESET)
 
+    def _close_time(self, opened: datetime.datetime, problem_id: int) -> datetime.datetime:
+        """Returns when problem :problem_id: closes if it opened at :opened:.
+
+        A problem stays open for a day, or until the next problem's scheduled date if that is later.
+        """
+        close_time = opened + TIMEDELTA
+        next_id = problem_id + 1
+        if next_id < len(self.problems) and self.problems[next_id].get('date') is not None:
+            close_time = max(close_time, datetime.datetime(*self.problems[next_id]['date'], HOUR_OF_RESET))
+        return close_time
+
+    def get_deadline(self) -> datetime.datetime:
+        """Returns when the current problem closes"""
+        return self._close_time(self.get_last_reset_time(), self.state['currentproblemid'])
+
+    def get_calendar(self, count: int) -> list[tuple[int, datetime.datetime]]:
+        """Returns (problem id, post time) for up to :count: upcoming problems"""
+        calendar = []
+        post_time = self.get_deadline()
+        for problem_id in range(self.state['currentproblemid'] + 1, min(len(self.problems), self.state['currentproblemid'] + 1 + count)):
+            calendar.append((problem_id, post_time))
+            # Resets are stored as dates, so a problem opens at HOUR_OF_RESET on its post date
+            post_time = self._close_time(datetime.datetime(*post_time.timetuple()[:3], HOUR_OF_RESET), problem_id)
+        return calendar
+
+    def get_answer(self, problem_id: int) -> Any:
+        """Returns the canonical answer of a problem, parsing it on first use"""
+        if problem_id not in self._parsed_answers:
+            problem = self.problems[problem_id]
+            self._parsed_answers[problem_id] = parse_answer(problem['answer'], problem['answerformat'])
+        return self._parsed_answers[problem_id]
+
     def is_current_problem(self) -> bool:
         """Returns whether there is a current problem"""
         return self.state['currentproblemid'] < len(self.problems)
 
     #
 
+    async def on_answer(self, message: discord.Message, answer: str) -> None:
+        """Handles an answer DM routed to this season"""
+        # Each user's messages are judged and answered in the order they arrived
+        async with self.user_locks(message.author.id):
+            with metrics.answer_stage_seconds.time(stage='validation'):
+                reply, solved_problem_id = self.judge_answer(message, answer)
+            with metrics.answer_stage_seconds.time(stage='reply'):
+                await message.channel.send(reply)
+        if solved_problem_id is not None:
+            self.role_grants.put_nowait((message.author.id, message.channel, solved_problem_id))
+
+    def judge_answer(self, message: discord.Message, given_answer: str) -> tuple[str, Optional[int]]:
+        """Checks an answer DM and records the attempt.
+
+        Runs without awaiting, so the check and the attempt update cannot interleave with
+        anything else. Returns (reply, id of the problem solved or None).
+        """
+        if not self.is_current_problem():
+            metrics.answers.inc(verdict='rejected')
+            return 'No problem is currently active.', None
+        if message.author.id not in self.users:
+            # Add user if nonexistent
+            self.update_user(message.author.id, **get_default_user_data())
+        attempt = self.attempts.get(message.author.id) or get_default_attempt()
+        if attempt['answered']:
+            metrics.answers.inc(verdict='rejected')
+            return 'You have already answered this problem.', None
+        if attempt['attemptsleft'] <= 0:
+            metrics.answers.inc(verdict='rejected')
+            return 'You have no attempts left.', None
+
+        problem_id = self.state['currentproblemid']
+        problem = self.problems[problem_id]
+        try:
+            value = parse_answer(given_answer, problem['answerformat'])
+        except AnswerError as e:
+            metrics.answers.inc(verdict='invalid')
+            return f'{e}\n*No credit lost. You still have {attempt["attemptsleft"]} attempts. Please try again.*', None
+
+        correct = value == self.get_answer(problem_id)
+        now = time.time()
+        self.history.record(message.author.id, problem_id, MAX_ATTEMPTS - attempt['attemptsleft'] + 1, correct,
+                            now, now - self.get_last_reset_time().timestamp())
+        if correct:
+            self.update_attempt(message.author.id, answered=True, attemptsleft=attempt['attemptsleft'])
+            self.solve_counts[attempt['attemptsleft']] += 1
+            metrics.answers.inc(verdict='correct')
+            logging.info('%s gave correct answer', message.author.name)
+            return 'Correct! You will receive points when the problem closes.', problem_id
+        attemptsleft = attempt['attemptsleft'] - 1
+        self.update_attempt(message.author.id, attemptsleft=attemptsleft)
+        metrics.answers.inc(verdict='wrong')
+        logging.info('%s gave WRONG answer (given_answer=%r)', message.author.name, given_answer)
+        return f'Incorrect! You have {attemptsleft} attempts left.', None
+
+    async def role_grant_worker(self) -> None:
+        """Gives the solved role to users queued by on_message"""
+        while True:
+            user_id, channel, problem_id = await self.role_grants.get()
+            try:
+                if problem_id != self.state['currentproblemid']:
+                    # The problem closed in the meantime and its roles were already cleared
+                    continue
+                with metrics.answer_stage_seconds.time(stage='guild_fetch'):
+                    role = await self.lookup.role(self.config['guildid'], self.config['solvedrole'])
+                    member = None if role is None else await self.lookup.member(role.guild, user_id)
+                if member is None:
+                    await channel.send('Failed to give solved role! Please contact an admin.')
+                    continue
+                async with self.transition_lock:
+                    # Waits out a reset in progress; roles removed by it must not be granted again afterwards
+                    if problem_id != self.state['currentproblemid']:
+                        continue
+                try:
+                    with metrics.answer_stage_seconds.time(stage='role_grant'):
+                        await member.add_roles(role)
+                except discord.errors.Forbidden:
+                    await channel.send('Failed to give solved role! I do not have permission! Please contact an admin.')
+            except Exception:
+                logging.exception(f'Could not give solved role to user ID {user_id}')
+            finally:
+                self.role_grants.task_done()
+
+
+def get_season_configs(config: dict[str, Any]) -> list[dict[str, Any]]:
+    """Splits config.json into one config per season.
+
+    Without a `seasons` list the whole file is a single season stored in data.*.
+    Otherwise every key outside `seasons` is a default for each season, and a
+    season is stored in data-<name>.* unless it sets `datafile`.
+    """
+    if 'seasons' not in config:
+        return [{'name': 'default', 'datafile': 'data', **config}]
+    shared = {key: value for key, value in config.items() if key != 'seasons'}
+    season_configs = []
+    for season in config['seasons']:
+        season_config = {**shared, **season}
+        season_config.setdefault('datafile', f'data-{season["name"]}')
+        season_configs.append(season_config)
+    names = [season_config['name'].lower() for season_config in season_configs]
+    if len(set(names)) != len(names):
+        raise ValueError('season names must be unique')
+    return season_configs
+
+
+class Router:
+    """Owns the client and routes events to the season (Main) they belong to.
+
+    Commands go to the season of the guild they are sent in; a guild with several
+    seasons picks the one whose problem channel the command was sent in, or its
+    first season. Answer DMs go to the only season with an open problem whose guild
+    the author is in, or to the season named at the start of the message.
+
+    on_message filters before any parsing or REST call: guild messages that are not
+    commands are ignored, and each user and guild has a token bucket (USER_RATE,
+    GUILD_RATE). Messages over the limit are dropped and counted in ommc_dropped_total.
+    """
+    client: commands.Bot
+
+    config: dict[str, Any]
+    lookup: Lookup
+    profiler: metrics.Profiler
+    seasons: list[Main]
+    _by_name: dict[str, Main]
+    _by_guild: dict[int, list[Main]]
+    user_limits: TokenBuckets
+    guild_limits: TokenBuckets
+    _throttled: set[int]  # users told they are sending too fast, until their bucket refills
+    exiting: bool
+
+    def __init__(self, client: Optional[commands.Bot] = None):
+        """Uses :client: instead of a new commands.Bot if given (the benchmarks pass a fake one)"""
+        with open('config.json', 'r') as f:
+            self.config = json.load(f)
+        if client is None:
+            intents = discord.Intents.default()
+            intents.members = True
+            intents.message_content = True
+            client = commands.Bot(command_prefix=self.config['prefix'], intents=intents)
+        self.client = client
+        self.client.remove_command('help')
+        self.lookup = Lookup(self.client)
+        self.lookup.register()
+        self.profiler = metrics.Profiler()
+        self.seasons = [Main(self.client, self.lookup, config) for config in get_season_configs(self.config)]
+        self._by_name = {season.name.lower(): season for season in self.seasons}
+        self._by_guild = {}
+        for season in self.seasons:
+            self._by_guild.setdefault(season.config['guildid'], []).append(season)
+        self.user_limits = TokenBuckets(*USER_RATE)
+        self.guild_limits = TokenBuckets(*GUILD_RATE)
+        self._throttled = set()
+        self.exiting = False
+        self.client.event(self.on_ready)
+        self.client.event(self.on_command_error)
+        self.client.event(self.on_message)
+
+    def termination_handler(self, signal, frame):
+        """Handles SIGINT and SIGTERM. Later signals while exiting are ignored, as the seasons are closed already."""
+        if self.exiting:
+            logging.info('already exiting')
+            return
+        self.exiting = True
+        logging.info('exiting')
+        for season in self.seasons:
+            season.close()
+        sys.exit(0)
+
+    def seasons_of(self, user_id: int) -> list[Main]:
+        """Returns the seasons whose guild :user_id: is in (all seasons if none), open ones first"""
+        seasons = []
+        for season in self.seasons:
+            guild = self.client.get_guild(season.config['guildid'])
+            if guild is not None and guild.get_member(user_id) is not None:
+                seasons.append(season)
+        return sorted(seasons or self.seasons, key=lambda season: not season.is_current_problem())
+
+    def resolve(self, ctx: commands.Context) -> Optional[Main]:
+        """Returns the season a command is for, or None in a guild without one"""
+        if ctx.guild is None:
+            return self.seasons_of(ctx.author.id)[0]
+        seasons = self._by_guild.get(ctx.guild.id)
+        if not seasons:
+            return None
+        for season in seasons:
+            if season.config['problemchannel'] == ctx.channel.id:
+                return season
+        return seasons[0]
+
+    def route_answer(self, message: discord.Message) -> tuple[Optional[Main], str]:
+        """Returns the season an answer DM is for (None if ambiguous) and the answer without a season name"""
+        if len(self.seasons) == 1:
+            return self.seasons[0], message.content
+        name, _, rest = message.content.strip().partition(' ')
+        season = self._by_name.get(name.rstrip(':').lower())
+        if season is not None:
+            return season, rest.strip()
+        open_seasons = [season for season in self.seasons_of(message.author.id) if season.is_current_problem()]
+        if len(open_seasons) == 1:
+            return open_seasons[0], message.content
+        return None, message.content
+
+    #
+
     async def on_ready(self) -> None:
         """Handles on_ready event"""
         logging.info(f'bot is ready, logged in as {self.client.user.display_name} ({self.client.user.id})')
@@ -238,80 +1037,96 @@ class Main:
             await ctx.send('Bad argument! Please try again.')
         elif error_type is commands.CommandNotFound:
             pass
+        elif error_type is commands.CheckFailure:
+            await ctx.send('There is no competition in this server.')
         else:
             logging.error(f'Ignoring exception in command {ctx.command}', exc_info=exception)
 
+    def is_command(self, content: str) -> bool:
+        """Returns whether :content: invokes a command. Answers may start with the prefix too (e.g. -5 with prefix -)."""
+        prefix = self.config['prefix']
+        if not content.startswith(prefix):
+            return False
+        name = content[len(prefix):].split(maxsplit=1)
+        return bool(name) and self.client.get_command(name[0]) is not None
+
     async def on_message(self, message: discord.Message) -> None:
         """Handles on_message event"""
         if message.author.bot:
             return
-        await self.client.process_commands(message)
-        if message.channel.type != discord.ChannelType.private:
-            # Respond in DMs only
+        is_dm = message.channel.type == discord.ChannelType.private
+        is_command = self.is_command(message.content)
+        if not is_dm and not is_command:
+            # Answers are taken in DMs only
             return
-        if not self.is_current_problem():
-            await message.channel.send('No problem is currently active.')
+        if not self.user_limits.take(message.author.id):
+            metrics.dropped.inc(reason='user_rate', route='command' if is_command else 'answer')
+            if is_dm and message.author.id not in self._throttled:
+                self._throttled.add(message.author.id)
+                await message.channel.send('You are sending messages too quickly. Please wait a few seconds.')
             return
-        if message.author.id not in self.users:
-            # Add user if nonexistent
-            self.users[message.author.id] = get_default_user_data()
-        user = self.users[message.author.id]
-        if user['answered']:
-            await message.channel.send('You have already answered this problem.')
-            return
-        if user['attemptsleft'] <= 0:
-            await message.channel.send('You have no attempts left.')
-            return
-        
-        problem = self.problems[self.state['currentproblemid']]
-        given_answer = message.content.lower()
-        validated, errmsg = validate_answer(given_answer, problem['answerformat'])
-        if not validated:
-            await message.channel.send(f'{errmsg}\n*No credit lost. You still have {user["attemptsleft"]} attempts. Please try again.*')
+        self._throttled.discard(message.author.id)
+        if not is_dm and not self.guild_limits.take(message.guild.id):
+            metrics.dropped.inc(reason='guild_rate', route='command')
             return
-
-        if given_answer == problem['answer']:
-            user['answered'] = True
-            guild = await self.client.fetch_guild(self.config['guildid'])
-            role = None if guild is None else guild.get_role(self.config['solvedrole'])
-            if role is None:
-                await message.channel.send('Failed to give solved role! Please contact an admin.')
-            else:
-                member = await guild.fetch_member(message.author.id)
-                if member is None:
-                    await message.channel.send('Failed to give solved role! Please contact an admin.')
-                else:
-                    try:
-                        await member.add_roles(role)
-                    except discord.errors.Forbidden:
-                        await message.channel.send('Failed to give solved role! I do not have permission! Please contact an admin.')
-            await message.channel.send('Correct! You will receive points when the problem closes.')
-            logging.info(f'{message.author.name} gave correct answer')
-        else:
-            user['attemptsleft'] -= 1
-            await message.channel.send(f'Incorrect! You have {user["attemptsleft"]} attempts left.')
-            logging.info(f'{message.author.name} gave WRONG answer ({given_answer=})')
+        if is_command:
+            await self.client.process_commands(message)
+            return
+        season, answer = self.route_answer(message)
+        if season is None:
+            names = ', '.join(f'`{season.name}`' for season in self.seasons)
+            await message.channel.send(f'Which competition is this answer for? Start your message with its name: {names}')
+            return
+        await season.on_answer(message, answer)
+
+    def console_namespace(self) -> dict[str, Any]:
+        """Names available in the admin console"""
+        return {
+            'router': self,
+            'seasons': {season.name: season for season in self.seasons},
+            'main': self.seasons[0],
+            'client': self.client,
+            'metrics': metrics,
+            'asyncio': asyncio,
+        }
 
     async def run(self):
         await self.client.add_cog(Commands(self))
-        self.check_time.start()
+        for season in self.seasons:
+            season.start()
+        asyncio.create_task(metrics.monitor_loop_lag())
+        if 'metricsport' in self.config:
+            await metrics.serve(self.config['metricsport'])
+        if 'console' in self.config:
+            await console.serve(self.config['console'], self.console_namespace())
         logging.info('starting bot')
         await self.client.start(self.config['token'])
 
 
 class Commands(commands.Cog):
-    main: Main
+    router: Router
     client: commands.Bot
 
-    def __init__(self, main_class: Main):
-        self.main = main_class
-        self.client = main_class.client
+    def __init__(self, router: Router):
+        self.router = router
+        self.client = router.client
+
+    def cog_check(self, ctx: commands.Context) -> bool:
+        """Picks the season the command is for and stores it as ctx.main"""
+        ctx.main = self.router.resolve(ctx)
+        return ctx.main is not None
+
+    async def cog_before_invoke(self, ctx: commands.Context) -> None:
+        ctx.started_at = time.perf_counter()
+
+    async def cog_after_invoke(self, ctx: commands.Context) -> None:
+        metrics.command_seconds.observe(time.perf_counter() - ctx.started_at, command=ctx.command.name)
 
     def validate_staff_role(self, ctx: commands.Context) -> bool:
         """Checks if the user has the staff role"""
         if ctx.guild is None:
             return False
-        return self.main.config['staffroleid'] in [role.id for role in ctx.author.roles]
+        return ctx.main.config['staffroleid'] in [role.id for role in ctx.author.roles]
 
     #
 
@@ -323,72 +1138,111 @@ class Commands(commands.Cog):
             description='**Commands**\n'
                         '`help` - show this message\n'
                         '`rank` - show your rank\n'
-                        '`problemstatus` - show the status of the current problem'
-                        '`leaderboard` - show the leaderboard'
+                        '`problemstatus` - show the status of the current problem\n'
+                        '`leaderboard` - show the leaderboard\n'
+                        '`mystats` - show your solves, attempts and streaks'
         )
         await ctx.send(embed=embed)
 
     @commands.command()
     @commands.cooldown(1, 2.0, commands.BucketType.user)
     async def rank(self, ctx: commands.Context) -> None:
-        if ctx.author.id not in self.main.users:
+        if ctx.author.id not in ctx.main.users:
             await ctx.send('You have not answered any problems yet.')
             return
-        points = self.main.users[ctx.author.id]['totalscore']
-        i = get_next_index(points)
-        nextstartext = 'None' if i is None else f'{STARS[i]} (in {POINTS_TO_EACH_STAR[i] - points} points)'
-        embed = discord.Embed(
-            title='Rank',
-            description=f'Points: **{points:,}**{get_star(points)}\n\n'
-                        f'Next Star: {nextstartext}',
-            color=discord.Color.random()
-        )
+        description = ctx.main.renders.get(('rank', ctx.author.id, ctx.main.score_epoch),
+                                            lambda: self.render_rank(ctx.main, ctx.author.id))
+        embed = discord.Embed(title='Rank', description=description, color=discord.Color.random())
         await ctx.send(embed=embed)
 
+    def render_rank(self, main: Main, user_id: int) -> str:
+        points = main.users[user_id]['totalscore']
+        position = main.rank_index.rank(user_id)
+        star, next_star, points_needed = main.star_tiers.lookup(points)
+        nextstartext = 'None' if next_star is None else f'{next_star} (in {points_needed} points)'
+        return (f'Points: **{points:,}**{star}\n'
+                f'Position: **#{position + 1}** of {len(main.rank_index)}\n\n'
+                f'Next Star: {nextstartext}')
+
     @commands.command()
     @commands.cooldown(1, 4.0, commands.BucketType.user)
     async def problemstatus(self, ctx: commands.Context) -> None:
         """Shows the status of the current problem"""
-        ending_time = int((self.main.get_last_reset_time() + TIMEDELTA).timestamp())
-        shares = [SHARES[user_data['attemptsleft']] for user_data in self.main.users.values() if user_data['answered']]
-        total_shares = sum(shares)
-        total_value = calculate_problem_value(total_shares)
+        ending_time = int(ctx.main.get_deadline().timestamp())
+        # The estimate moves with the clock, so it is re-rendered at most once a minute.
+        # Rounding up keeps the elapsed fraction positive right after a reset.
+        now = (int(time.time()) // 60 + 1) * 60
+        description = ctx.main.renders.get(('problemstatus', ctx.main.solve_epoch, ending_time, now),
+                                            lambda: self.render_problemstatus(ctx.main, ending_time, now))
+        embed = discord.Embed(title='Problem Status', description=description, color=discord.Color.random())
+        await ctx.send(embed=embed)
+
+    def render_problemstatus(self, main: Main, ending_time: int, now: int) -> str:
+        total_shares = main.total_shares
+        total_value = scoring.problem_value(total_shares)
         current_values = '/'.join(f'**{total_value*share_value:.0f}**' for share_value in SHARES[-1:0:-1])
-        time_elapsed_fraction = 1 - (ending_time - int(time.time()))/86400
-        estimated_value = calculate_problem_value(total_shares / (time_elapsed_fraction**0.6))
+        # Problems can stay open for several days, until the next problem's scheduled date
+        opened = int(main.get_last_reset_time().timestamp())
+        window = max(ending_time - opened, 60)
+        time_elapsed_fraction = min(max((now - opened) / window, 60 / window), 1.0)
+        estimated_value = scoring.estimated_value(total_shares, time_elapsed_fraction)
         estimated_values = '/'.join(f'**{estimated_value*share_value:.0f}**' for share_value in SHARES[-1:0:-1])
-        embed = discord.Embed(
-            title='Problem Status',
-            description=f'Ends <t:{ending_time}:R>\n\n'
-                        f'Solves: **{total_shares:.2f}** ({len(shares)} total people)\n\n'
-                        f'Current value: {current_values} {STARS[0]}\n'
-                        f'Estimated value: {estimated_values} {STARS[0]}',
-            color=discord.Color.random()
-        )
-        await ctx.send(embed=embed)
+        return (f'Ends <t:{ending_time}:R>\n\n'
+                f'Solves: **{total_shares:.2f}** ({main.solver_count} total people)\n\n'
+                f'Current value: {current_values} {main.star_tiers.stars[0]}\n'
+                f'Estimated value: {estimated_values} {main.star_tiers.stars[0]}')
 
     @commands.command()
     @commands.cooldown(1, 4.0, commands.BucketType.user)
     async def leaderboard(self, ctx: commands.Context, page: int = None) -> None:
         """Shows the leaderboard"""
-        leaderboard = sorted(self.main.users.items(), key=lambda x: x[1]['totalscore'], reverse=True)
-        max_page = math.ceil(len(self.main.users) / LEAD_PAGE_SIZE)
+        rank_index = ctx.main.rank_index
+        max_page = max(math.ceil(len(rank_index) / LEAD_PAGE_SIZE), 1)
         if page is None:
-            user_i = next(i for i, (user_id, total_score) in enumerate(leaderboard) if user_id == ctx.author.id)
-            page = user_i//LEAD_PAGE_SIZE + 1
+            user_i = rank_index.rank(ctx.author.id)
+            page = 1 if user_i is None else user_i//LEAD_PAGE_SIZE + 1
         else:
             page = min(max(page, 1), max_page)
-        i_start = (page - 1) * LEAD_PAGE_SIZE
-        descs = []
-        for i, (user_id, userdata) in enumerate(leaderboard[i_start:i_start+LEAD_PAGE_SIZE], start=i_start):
-            s = f'**#{i+1}** <@{user_id}>\n\u2192 **{userdata["totalscore"]:,}**{get_star(userdata["totalscore"])}'
-            if user_id == ctx.author.id:
-                s = f'\u25c6 {s}'
-            descs.append(s)
-        embed = discord.Embed(title='Leaderboard', description='\n\n'.join(descs), color=discord.Color.random())
+        user_ids, lines, description = ctx.main.renders.get(('leaderboard', page, ctx.main.score_epoch),
+                                                             lambda: self.render_leaderboard(ctx.main, page))
+        if ctx.author.id in user_ids:
+            highlighted = user_ids.index(ctx.author.id)
+            description = '\n\n'.join(f'\u25c6 {s}' if i == highlighted else s for i, s in enumerate(lines))
+        embed = discord.Embed(title='Leaderboard', description=description, color=discord.Color.random())
         embed.set_footer(text=f'Page {page}/{max_page}')
         await ctx.send(embed=embed)
 
+    def render_leaderboard(self, main: Main, page: int) -> tuple[list[int], list[str], str]:
+        """Returns the user ids and lines on :page: and the description without a highlight"""
+        i_start = (page - 1) * LEAD_PAGE_SIZE
+        user_ids, lines = [], []
+        for i, (user_id, totalscore) in enumerate(main.rank_index.page(i_start, LEAD_PAGE_SIZE), start=i_start):
+            user_ids.append(user_id)
+            lines.append(f'**#{i+1}** <@{user_id}>\n\u2192 **{totalscore:,}**{main.star_tiers.star(totalscore)}')
+        return user_ids, lines, '\n\n'.join(lines)
+
+    @commands.command()
+    @commands.cooldown(1, 4.0, commands.BucketType.user)
+    async def mystats(self, ctx: commands.Context) -> None:
+        """Shows your solves, attempts, solve time and streaks"""
+        if history.np is None:
+            await ctx.send('Statistics need NumPy, which is not installed.')
+            return
+        stats = history.user_stats(ctx.main.history.columns(), ctx.author.id, ctx.main.state['currentproblemid'])
+        if not stats['attempted']:
+            await ctx.send('You have not answered any problems yet.')
+            return
+        median = 'None' if stats['median_solve_time'] is None else format_duration(stats['median_solve_time'])
+        embed = discord.Embed(
+            title='Your Stats',
+            description=f'Solved: **{stats["solved"]}** of {stats["attempted"]} attempted\n'
+                        f'Solved on attempt: {format_attempts(stats["attempts"])}\n'
+                        f'Median solve time: **{median}**\n\n'
+                        f'Streak: **{stats["current_streak"]}** (longest: **{stats["longest_streak"]}**)',
+            color=discord.Color.random()
+        )
+        await ctx.send(embed=embed)
+
     #
 
     @commands.command()
@@ -397,43 +1251,197 @@ class Commands(commands.Cog):
             await ctx.send('You do not have permission to use this command.')
             return
 
-        last_reset = self.main.get_last_reset_time()
-        problems_left = len(self.main.problems) - self.main.state['currentproblemid'] - 1
-        guild = await self.client.fetch_guild(self.main.config['guildid'])
-        role = None if guild is None else guild.get_role(self.main.config['solvedrole'])
-        desc = (f'Current problem: **#{self.main.state["currentproblemid"]}**\n'
-                f'Active: **{"yes" if self.main.is_current_problem() else "no"}**\n\n'
-                f'Problem count: **{len(self.main.problems)}**\n\n'
+        last_reset = ctx.main.get_last_reset_time()
+        problems_left = len(ctx.main.problems) - ctx.main.state['currentproblemid'] - 1
+        guild = await ctx.main.lookup.guild(ctx.main.config['guildid'])
+        role = await ctx.main.lookup.role(ctx.main.config['guildid'], ctx.main.config['solvedrole'])
+        today = datetime.date.today().timetuple()[:3]
+        next_scheduled = next((f'#{problem_id} on {datetime.date(*date)}'
+                               for date, problem_id in ctx.main.problem_index.scheduled_from(today, LEAD_PAGE_SIZE)
+                               if problem_id > ctx.main.state['currentproblemid']), 'none')
+        staged = ctx.main.staged_post
+        if ctx.main.next_post() is None:
+            next_post = 'no problem left'
+        elif not ctx.main.is_next_post_staged():
+            next_post = f'not staged yet (staged {STAGE_LEAD / 60:g} minutes before the reset)'
+        else:
+            image = 'ok'
+            if not ctx.main.config.get('checkimages', True):
+                image = 'not checked'
+            elif staged.image_error is not None:
+                image = f'**BROKEN** ({staged.image_error})'
+            next_post = f'staged for {len(staged.channels)} channels, image {image}'
+        desc = (f'Season: **{ctx.main.name}**\n'
+                f'Current problem: **#{ctx.main.state["currentproblemid"]}**\n'
+                f'Active: **{"yes" if ctx.main.is_current_problem() else "no"}**\n\n'
+                f'Problem count: **{len(ctx.main.problems)}**\n'
+                f'Next scheduled: {next_scheduled}\n\n'
                 f'Last reset: <t:{int(last_reset.timestamp())}:R> (calculated time)\n'
-                f'Next reset: <t:{int((last_reset + TIMEDELTA).timestamp())}:R>\n\n'
+                f'Next reset: <t:{int(ctx.main.get_deadline().timestamp())}:R>\n'
+                f'Next post: {next_post}\n\n'
                 f'Guild: {"**FAILED**" if guild is None else guild.name}\n'
-                f'Role to give: <@&{self.main.config["solvedrole"]}> (successfully fetched: **{role is not None}**)\n\n'
+                f'Role to give: <@&{ctx.main.config["solvedrole"]}> (successfully fetched: **{role is not None}**)\n\n'
                 f'{"**ATTENTION!** Only " if problems_left <= 2 else ""}{problems_left} problems left'
                 )
         embed = discord.Embed(title='Status', description=desc)
         await ctx.send(embed=embed)
 
+    @commands.command()
+    async def stars(self, ctx: commands.Context) -> None:
+        """Shows how many users are in each star tier"""
+        if not self.validate_staff_role(ctx):
+            await ctx.send('You do not have permission to use this command.')
+            return
+
+        star_tiers = ctx.main.star_tiers
+        lines = [f'{star} ({points:,}+): **{count}**'
+                 for points, (star, count) in zip(star_tiers.thresholds, star_tiers.histogram(ctx.main.rank_index))]
+        embed = discord.Embed(title='Star Distribution', description='\n'.join(lines))
+        await ctx.send(embed=embed)
+
+    @commands.command(usage='problemstats [problemid]')
+    async def problemstats(self, ctx: commands.Context, problemid: int = None) -> None:
+        """Shows solve rate, attempts and solve times of a problem (the current one by default)"""
+        if not self.validate_staff_role(ctx):
+            await ctx.send('You do not have permission to use this command.')
+            return
+        if history.np is None:
+            await ctx.send('Statistics need NumPy, which is not installed.')
+            return
+
+        if problemid is None:
+            problemid = min(ctx.main.state['currentproblemid'], len(ctx.main.problems) - 1)
+        if not 0 <= problemid < len(ctx.main.problems):
+            await ctx.send('No such problem.')
+            return
+        stats = history.problem_stats(ctx.main.history.columns(), problemid)
+        percentiles = '/'.join(f'**{format_duration(seconds)}**' for seconds in stats['solve_time_percentiles']) or 'None'
+        embed = discord.Embed(
+            title=f'Problem #{problemid}',
+            description=f'Submissions: **{stats["submissions"]}** from {stats["attempters"]} people\n'
+                        f'Solvers: **{stats["solvers"]}** ({stats["solve_rate"]:.0%})\n'
+                        f'Solved on attempt: {format_attempts(stats["attempts"])}\n'
+                        f'Solve time p{"/p".join(map(str, history.PERCENTILES))}: {percentiles}'
+        )
+        await ctx.send(embed=embed)
+
+    @commands.command()
+    async def difficulty(self, ctx: commands.Context) -> None:
+        """Shows the problems with the lowest solve rates"""
+        if not self.validate_staff_role(ctx):
+            await ctx.send('You do not have permission to use this command.')
+            return
+        if history.np is None:
+            await ctx.send('Statistics need NumPy, which is not installed.')
+            return
+
+        lines = [f'#{problem_id}: **{solve_rate:.0%}** of {attempters} solved, {mean_attempts:.1f} attempts per solve'
+                 for problem_id, attempters, _, solve_rate, mean_attempts
+                 in history.difficulty(ctx.main.history.columns())[:LEAD_PAGE_SIZE]]
+        embed = discord.Embed(title='Hardest Problems', description='\n'.join(lines) or 'No submissions yet.')
+        await ctx.send(embed=embed)
+
+    @commands.command(name='metrics', usage='metrics [profile on|off]')
+    async def show_metrics(self, ctx: commands.Context, *, args: str = '') -> None:
+        """Shows a summary of the metrics, or switches the profiler on or off"""
+        if not self.validate_staff_role(ctx):
+            await ctx.send('You do not have permission to use this command.')
+            return
+
+        if args == 'profile on':
+            self.router.profiler.start()
+            await ctx.send('Profiler started.')
+            return
+        if args == 'profile off':
+            stats = self.router.profiler.stop()
+            await ctx.send(f'```\n{stats[:1900]}\n```' if stats else 'Profiler was not running.')
+            return
+
+        lines = ['**Answers**: ' + ', '.join(f'{dict(labels)["verdict"]} {value:g}'
+                                               for labels, value in sorted(metrics.answers.values.items())),
+                 '**Dropped**: ' + (', '.join(f'{dict(labels)["route"]} over {dict(labels)["reason"]} {value:g}'
+                                              for labels, value in sorted(metrics.dropped.values.items())) or 'none')]
+        for histogram in (metrics.answer_stage_seconds, metrics.command_seconds, metrics.dispatch_seconds,
+                          metrics.next_problem_seconds, metrics.save_seconds, metrics.loop_lag_seconds):
+            for labels in sorted(histogram.values):
+                label_text = ','.join(value for _, value in labels)
+                kwargs = dict(labels)
+                lines.append(f'`{histogram.name}{"{" + label_text + "}" if label_text else ""}`: '
+                             f'n={histogram.count(**kwargs)} p50\u2264{histogram.quantile(0.5, **kwargs):g}s '
+                             f'p99\u2264{histogram.quantile(0.99, **kwargs):g}s')
+        lines.append(f'Profiler: **{"on" if self.router.profiler.running else "off"}**')
+        embed = discord.Embed(title='Metrics', description='\n'.join(lines)[:4000])
+        await ctx.send(embed=embed)
+
     @commands.command(usage='addproblem <imageurl> <answer> <answerformat>')
     async def addproblem(self, ctx: commands.Context, imageurl: str, answer: str, answerformat: str) -> None:
         if not self.validate_staff_role(ctx):
             await ctx.send('You do not have permission to use this command.')
             return
 
-        valid_answer_formats = ('integer', 'fraction', 'string')
-        if answerformat not in valid_answer_formats:
-            await ctx.send(f'Invalid answer format. Must be one of: {", ".join(valid_answer_formats)}')
+        if answerformat not in ANSWER_PARSERS:
+            await ctx.send(f'Invalid answer format. Must be one of: {", ".join(ANSWER_PARSERS)}')
             return
         answer = answer.lower()
         validated, errmsg = validate_answer(answer, answerformat)
         if not validated:
             await ctx.send(f'The answer you gave does not comply with the format `{answerformat}`: {errmsg}')
             return
-        self.main.problems.append({
+        ctx.main.commit(('problem', len(ctx.main.problems), {
             'imageurl': imageurl,
             'answer': answer,
             'answerformat': answerformat,
-        })
-        await ctx.send(f'Problem added (#{len(self.main.problems) - 1})')
+        }))
+        await ctx.send(f'Problem added (#{len(ctx.main.problems) - 1})')
+
+    @commands.command(usage='importproblems (attach a .csv or .jsonl problem set)')
+    async def importproblems(self, ctx: commands.Context) -> None:
+        """Appends every problem in the attached problem set, or none if any row is invalid"""
+        if not self.validate_staff_role(ctx):
+            await ctx.send('You do not have permission to use this command.')
+            return
+
+        if not ctx.message.attachments:
+            await ctx.send(f'Attach a problem set.\n```\n{ctx.command.usage}\n```')
+            return
+        attachment = ctx.message.attachments[0]
+        try:
+            fmt = detect_format(attachment.filename)
+            lines = io.StringIO((await attachment.read()).decode('utf-8-sig'), newline='')
+        except ValueError as e:  # also UnicodeDecodeError
+            await ctx.send(f'Could not read {attachment.filename}: {e}')
+            return
+        problems, errors = load_problem_set(lines, fmt)
+        if errors:
+            report = [f'Line {line_number}: {error}' for line_number, error in errors[:IMPORT_ERRORS_SHOWN]]
+            if len(errors) > IMPORT_ERRORS_SHOWN:
+                report.append(f'... and {len(errors) - IMPORT_ERRORS_SHOWN} more')
+            embed = discord.Embed(title=f'{len(errors)} errors, nothing was imported', description='\n'.join(report)[:4000])
+            await ctx.send(embed=embed)
+            return
+        if not problems:
+            await ctx.send('The problem set is empty.')
+            return
+        start = len(ctx.main.problems)
+        ctx.main.commit(('batch', list(import_ops(start, problems))))
+        await ctx.send(f'Imported {len(problems)} problems (#{start} to #{start + len(problems) - 1})')
+
+    @commands.command(usage='problems [tag]')
+    async def problems(self, ctx: commands.Context, tag: str = None) -> None:
+        """Lists the tags, or the problems with a tag"""
+        if not self.validate_staff_role(ctx):
+            await ctx.send('You do not have permission to use this command.')
+            return
+
+        problem_index = ctx.main.problem_index
+        if tag is None:
+            embed = discord.Embed(title='Tags', description=', '.join(
+                f'`{tag}` ({count})' for tag, count in problem_index.tag_counts().items()) or 'No tags.')
+        else:
+            embed = discord.Embed(title=f'Problems tagged {tag}', description=', '.join(
+                f'#{problem_id}' for problem_id in problem_index.with_tag(tag)) or 'None.')
+        embed.description = embed.description[:4000]
+        await ctx.send(embed=embed)
 
     @commands.command()
     async def forcenextproblem(self, ctx: commands.Context) -> None:
@@ -441,8 +1449,8 @@ class Commands(commands.Cog):
             await ctx.send('You do not have permission to use this command.')
             return
 
-        await self.main.next_problem()
-        await ctx.send(f'Problem is now #{self.main.state["currentproblemid"]}')
+        await ctx.main.next_problem(ctx.main.state['currentproblemid'])
+        await ctx.send(f'Problem is now #{ctx.main.state["currentproblemid"]}')
 
     @commands.command()
     async def resetproblems(self, ctx: commands.Context, *, extra: str = '') -> None:
@@ -454,15 +1462,15 @@ class Commands(commands.Cog):
             await ctx.send('Specify what to delete.')
             return
         if 'currentproblemid' in extra:
-            self.main.state['currentproblemid'] = 0
+            ctx.main.update_state(currentproblemid=0)
         if 'problems' in extra:
-            self.main.problems.clear()
+            ctx.main.commit(('clearproblems',))
+            ctx.main.history.clear()
         if 'lastreset' in extra:
-            self.main.state['lastreset'] = [1970, 1, 1]
+            ctx.main.update_state(lastreset=[1970, 1, 1])
         if '-iknowwhatimdoing-195827485091-allpoints' in extra:
-            print(self.main.users)
-            for userdata in self.main.users.values():
-                userdata['totalscore'] = 0
+            print(ctx.main.users)
+            ctx.main.commit(('users', {'totalscore': 0}))
         await ctx.send(f'Done. (extra = `{extra}`)')
 
     @commands.command()
@@ -470,49 +1478,66 @@ class Commands(commands.Cog):
         if not self.validate_staff_role(ctx):
             await ctx.send('You do not have permission to use this command.')
             return
-        await self.main.post_question()
+        await ctx.main.post_question()
 
     @commands.command()
     async def extenddeadline(self, ctx: commands.Context) -> None:
         if not self.validate_staff_role(ctx):
             await ctx.send('You do not have permission to use this command.')
             return
-        current_deadline = datetime.datetime(*self.main.state['lastreset']) + TIMEDELTA
-        self.main.state['lastreset'] = current_deadline.timetuple()[:3]
-        await ctx.send(f'`lastreset` is now {self.main.state["lastreset"]}, run `postagain` to show changes')
+        current_deadline = datetime.datetime(*ctx.main.state['lastreset']) + TIMEDELTA
+        ctx.main.update_state(lastreset=current_deadline.timetuple()[:3])
+        await ctx.send(f'`lastreset` is now {ctx.main.state["lastreset"]}, run `postagain` to show changes')
+
+    @commands.command(usage='schedule [problemid] [YYYY-MM-DD|none]')
+    async def schedule(self, ctx: commands.Context, problemid: int = None, date: str = None) -> None:
+        """Shows upcoming post times, or sets the earliest date a problem is posted"""
+        if not self.validate_staff_role(ctx):
+            await ctx.send('You do not have permission to use this command.')
+            return
+
+        if problemid is None:
+            lines = [f'#{problem_id}: <t:{int(post_time.timestamp())}:f>'
+                     f'{" (scheduled)" if ctx.main.problems[problem_id].get("date") is not None else ""}'
+                     for problem_id, post_time in ctx.main.get_calendar(LEAD_PAGE_SIZE)]
+            embed = discord.Embed(title='Schedule', description='\n'.join(lines) or 'No upcoming problems.')
+            await ctx.send(embed=embed)
+            return
+        if not ctx.main.state['currentproblemid'] < problemid < len(ctx.main.problems):
+            await ctx.send('Only upcoming problems can be scheduled.')
+            return
+        if date is None or date == 'none':
+            problem_date = None
+        else:
+            try:
+                problem_date = list(datetime.date.fromisoformat(date).timetuple()[:3])
+            except ValueError:
+                await ctx.send('Invalid date. Use `YYYY-MM-DD`.')
+                return
+        ctx.main.commit(('problem', problemid, ctx.main.problems[problemid] | {'date': problem_date}))
+        same_day = [] if problem_date is None else [f'#{problem_id}' for problem_id in ctx.main.problem_index.on_date(tuple(problem_date))
+                                                    if problem_id != problemid]
+        await ctx.send(f'Problem #{problemid} is now scheduled for {date or "none"}'
+                       f'{" (also scheduled that day: " + ", ".join(same_day) + ")" if same_day else ""}')
 
     @commands.command()
     async def awaitexecutecode(self, ctx: commands.Context) -> None:
+        """Points staff at the admin console. Code is never run from Discord messages, since that would let
+        anyone with the staff role run arbitrary code on the host."""
         if not self.validate_staff_role(ctx):
             await ctx.send('You do not have permission to use this command.')
             return
-        await ctx.send('Waiting for input (async is ok)! The bot will temporarily block.')
-        code = input()
-        environment = {
-            'self': self,
-            'main': self.main,
-            'client': self.main.client,
-            'ctx': ctx
-        }
-        to_compile = f'async def _func_():\n  {code}'
-        try:
-            exec(to_compile, environment)
-        except Exception:
-            await ctx.send('Compilation failed.')
+        if 'console' in self.router.config:
+            await ctx.send('Code runs in the admin console on the bot\'s host: `python console.py <path>` with the `console` path from config.json.')
         else:
-            func = environment['_func_']
-            try:
-                await func()
-            except Exception as e:
-                await ctx.send(f'Execution failed. {e}')
-            await ctx.send('Finished.')
+            await ctx.send('Code runs in the admin console on the bot\'s host. Set the `console` key in config.json to enable it.')
 
 
 def main():
-    main_class = Main()
-    signal.signal(signal.SIGINT, main_class.termination_handler)
-    signal.signal(signal.SIGTERM, main_class.termination_handler)
-    asyncio.run(main_class.run())
+    router = Router()
+    signal.signal(signal.SIGINT, router.termination_handler)
+    signal.signal(signal.SIGTERM, router.termination_handler)
+    asyncio.run(router.run())
 
 
 if __name__ == '__main__':
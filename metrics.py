@@ -0,0 +1,211 @@
+"""
+
+OMMC PROBLEM OF THE DAY BOT - metrics
+
+Counters, gauges and latency histograms kept in process, rendered in the
+Prometheus text format. serve() exposes them over HTTP on localhost, and
+the staff `metrics` command shows a summary in Discord.
+
+"""
+
+
+import asyncio
+import bisect
+import contextlib
+import cProfile
+import io
+import logging
+import math
+import pstats
+import time
+from typing import Any, Iterator, Optional
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0)
+LOOP_LAG_INTERVAL = 0.5
+
+Labels = tuple[tuple[str, str], ...]
+
+
+def _labels(labels: dict[str, Any]) -> Labels:
+    return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+
+def _format_labels(labels: Labels, extra: Labels = ()) -> str:
+    labels = labels + extra
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{key}="{value}"' for key, value in labels) + '}'
+
+
+class Counter:
+    kind = 'counter'
+
+    def __init__(self, name: str, help_text: str):
+        self.name = name
+        self.help_text = help_text
+        self.values: dict[Labels, float] = {}
+
+    def inc(self, amount: float = 1.0, **labels) -> None:
+        key = _labels(labels)
+        self.values[key] = self.values.get(key, 0.0) + amount
+
+    def render(self) -> Iterator[str]:
+        for labels, value in self.values.items():
+            yield f'{self.name}{_format_labels(labels)} {value:g}'
+
+
+class Gauge(Counter):
+    kind = 'gauge'
+
+    def set(self, value: float, **labels) -> None:
+        self.values[_labels(labels)] = value
+
+
+class Histogram:
+    kind = 'histogram'
+
+    def __init__(self, name: str, help_text: str, buckets: tuple[float, ...] = LATENCY_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = buckets
+        # labels -> [count per bucket (+inf last), sum]
+        self.values: dict[Labels, tuple[list[int], list[float]]] = {}
+
+    def observe(self, value: float, **labels) -> None:
+        key = _labels(labels)
+        if key not in self.values:
+            self.values[key] = ([0] * (len(self.buckets) + 1), [0.0])
+        counts, total = self.values[key]
+        counts[bisect.bisect_left(self.buckets, value)] += 1
+        total[0] += value
+
+    @contextlib.contextmanager
+    def time(self, **labels) -> Iterator[None]:
+        """Observes how long the block takes"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def count(self, **labels) -> int:
+        entry = self.values.get(_labels(labels))
+        return 0 if entry is None else sum(entry[0])
+
+    def quantile(self, q: float, **labels) -> float:
+        """Estimates a quantile as the upper bound of the bucket it falls in"""
+        entry = self.values.get(_labels(labels))
+        if entry is None:
+            return math.nan
+        counts = entry[0]
+        target = q * sum(counts)
+        running = 0
+        for upper, count in zip(self.buckets + (math.inf,), counts):
+            running += count
+            if running >= target:
+                return upper
+        return math.inf
+
+    def render(self) -> Iterator[str]:
+        for labels, (counts, total) in self.values.items():
+            running = 0
+            for upper, count in zip(self.buckets + (math.inf,), counts):
+                running += count
+                le = '+Inf' if upper == math.inf else f'{upper:g}'
+                yield f'{self.name}_bucket{_format_labels(labels, (("le", le),))} {running}'
+            yield f'{self.name}_sum{_format_labels(labels)} {total[0]:g}'
+            yield f'{self.name}_count{_format_labels(labels)} {running}'
+
+
+class Registry:
+    def __init__(self):
+        self.metrics: dict[str, Any] = {}
+
+    def _get(self, cls: type, name: str, help_text: str) -> Any:
+        if name not in self.metrics:
+            self.metrics[name] = cls(name, help_text)
+        return self.metrics[name]
+
+    def counter(self, name: str, help_text: str) -> Counter:
+        return self._get(Counter, name, help_text)
+
+    def gauge(self, name: str, help_text: str) -> Gauge:
+        return self._get(Gauge, name, help_text)
+
+    def histogram(self, name: str, help_text: str) -> Histogram:
+        return self._get(Histogram, name, help_text)
+
+    def render(self) -> str:
+        """Returns all metrics in the Prometheus text exposition format"""
+        lines = []
+        for metric in self.metrics.values():
+            lines.append(f'# HELP {metric.name} {metric.help_text}')
+            lines.append(f'# TYPE {metric.name} {metric.kind}')
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+answers = REGISTRY.counter('ommc_answers_total', 'Answer DMs by verdict')
+dropped = REGISTRY.counter('ommc_dropped_total', 'Messages dropped by rate limits, by reason and route')
+answer_stage_seconds = REGISTRY.histogram('ommc_answer_stage_seconds', 'Time spent in each stage of handling an answer DM')
+command_seconds = REGISTRY.histogram('ommc_command_seconds', 'Command handler latency')
+dispatch_seconds = REGISTRY.histogram('ommc_dispatch_seconds', 'Duration of next_problem fan-out batches')
+dispatch_jobs = REGISTRY.counter('ommc_dispatch_jobs_total', 'Fan-out jobs by outcome')
+next_problem_seconds = REGISTRY.histogram('ommc_next_problem_seconds', 'Duration of next_problem')
+post_seconds = REGISTRY.histogram('ommc_post_seconds', 'Time from reset to the problem being posted in every channel')
+save_seconds = REGISTRY.histogram('ommc_save_seconds', 'Duration of save_data')
+save_bytes = REGISTRY.gauge('ommc_save_bytes', 'Size of the last saved snapshot')
+render_cache = REGISTRY.counter('ommc_render_cache_total', 'Render cache lookups by view and outcome')
+loop_lag_seconds = REGISTRY.histogram('ommc_event_loop_lag_seconds', 'How late the event loop wakes up a sleeping task')
+
+
+async def monitor_loop_lag() -> None:
+    """Records event loop lag forever"""
+    loop = asyncio.get_running_loop()
+    while True:
+        start = loop.time()
+        await asyncio.sleep(LOOP_LAG_INTERVAL)
+        loop_lag_seconds.observe(max(loop.time() - start - LOOP_LAG_INTERVAL, 0.0))
+
+
+async def serve(port: int, host: str = '127.0.0.1') -> None:
+    """Serves REGISTRY at http://:host:::port:/metrics"""
+    from aiohttp import web  # installed with discord.py
+
+    async def handle(request: web.Request) -> web.Response:
+        return web.Response(text=REGISTRY.render(), content_type='text/plain', charset='utf-8')
+
+    app = web.Application()
+    app.router.add_get('/metrics', handle)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    logging.info(f'serving metrics on http://{host}:{port}/metrics')
+
+
+class Profiler:
+    """cProfile that can be switched on and off while the bot runs"""
+
+    def __init__(self):
+        self._profile: Optional[cProfile.Profile] = None
+
+    @property
+    def running(self) -> bool:
+        return self._profile is not None
+
+    def start(self) -> None:
+        if self._profile is None:
+            self._profile = cProfile.Profile()
+            self._profile.enable()
+
+    def stop(self, limit: int = 20) -> str:
+        """Stops profiling and returns the top :limit: functions by cumulative time"""
+        if self._profile is None:
+            return ''
+        self._profile.disable()
+        out = io.StringIO()
+        pstats.Stats(self._profile, stream=out).sort_stats('cumulative').print_stats(limit)
+        self._profile = None
+        return out.getvalue()
@@ -0,0 +1,234 @@
+"""
+
+OMMC PROBLEM OF THE DAY BOT - problem bank
+
+Bulk import of problem sets and an index of the problems by date and tag.
+
+A problem set is a CSV file with a header row, or JSON Lines with one object per
+line. Each problem has `imageurl`, `answer` and `answerformat`, and optionally a
+`date` (YYYY-MM-DD, the earliest day it is posted) and `tags` (a list in JSON,
+separated by `;` in CSV). Rows are validated in batches as they are read, every
+error is reported with its line number, and nothing is imported unless all rows
+are valid.
+
+Staff import a file by attaching it to `importproblems`. With the bot stopped,
+`python problembank.py import problems.csv [datafile]` imports into data.* (or
+the season's datafile) directly; add `--check` to only validate.
+
+"""
+
+
+import bisect
+import csv
+import datetime
+import json
+import logging
+import os
+import re
+import sys
+from typing import Any, Iterable, Iterator, Optional
+
+from answers import ANSWER_PARSERS, AnswerError, parse_answer
+
+IMPORT_BATCH = 100  # rows validated, and problems committed, at a time
+REQUIRED_FIELDS = ('imageurl', 'answer', 'answerformat')
+TAG_SPLIT_RE = re.compile(r'\s*;\s*')
+URL_RE = re.compile(r'https?://\S+')
+
+Date = tuple[int, int, int]
+
+
+def detect_format(filename: str) -> str:
+    """Returns 'csv' or 'jsonl' from the extension of :filename:"""
+    extension = os.path.splitext(filename)[1].lower()
+    if extension == '.csv':
+        return 'csv'
+    if extension in ('.jsonl', '.ndjson'):
+        return 'jsonl'
+    raise ValueError(f'unknown problem set format {extension!r}, use .csv or .jsonl')
+
+
+def read_rows(lines: Iterable[str], fmt: str) -> Iterator[tuple[int, Any]]:
+    """Yields (line number, row) for each problem in :lines:. A row that cannot be read is a ValueError."""
+    if fmt == 'csv':
+        reader = csv.DictReader(lines)
+        for row in reader:
+            yield reader.line_num, row
+    elif fmt == 'jsonl':
+        for line_number, line in enumerate(lines, start=1):
+            if not line.strip():
+                continue
+            try:
+                row = json.loads(line)
+            except json.JSONDecodeError as e:
+                yield line_number, ValueError(f'invalid JSON: {e.msg}')
+                continue
+            yield line_number, row if isinstance(row, dict) else ValueError('expected a JSON object')
+    else:
+        raise ValueError(f'unknown problem set format {fmt!r}')
+
+
+def parse_problem(row: dict[str, Any]) -> dict[str, Any]:
+    """Validates one row and returns it as a problem. Raises ValueError with a message for staff."""
+    missing = [field for field in REQUIRED_FIELDS if not str(row.get(field) or '').strip()]
+    if missing:
+        raise ValueError(f'missing {", ".join(missing)}')
+    imageurl = str(row['imageurl']).strip()
+    if URL_RE.fullmatch(imageurl) is None:
+        raise ValueError(f'imageurl {imageurl!r} is not a URL')
+    answerformat = str(row['answerformat']).strip().lower()
+    if answerformat not in ANSWER_PARSERS:
+        raise ValueError(f'answerformat must be one of: {", ".join(ANSWER_PARSERS)}')
+    answer = str(row['answer']).strip().lower()
+    try:
+        parse_answer(answer, answerformat)
+    except AnswerError as e:
+        raise ValueError(f'answer does not comply with the format `{answerformat}`: {e}')
+    problem = {
+        'imageurl': imageurl,
+        'answer': answer,
+        'answerformat': answerformat,
+    }
+    date = str(row.get('date') or '').strip()
+    if date:
+        try:
+            problem['date'] = list(datetime.date.fromisoformat(date).timetuple()[:3])
+        except ValueError:
+            raise ValueError(f'date {date!r} is not YYYY-MM-DD')
+    tags = row.get('tags') or []
+    if isinstance(tags, str):
+        tags = TAG_SPLIT_RE.split(tags.strip())
+    tags = sorted({str(tag).strip().lower() for tag in tags} - {''})
+    if tags:
+        problem['tags'] = tags
+    return problem
+
+
+def read_problems(lines: Iterable[str], fmt: str,
+                  batch_size: int = IMPORT_BATCH) -> Iterator[tuple[list[dict[str, Any]], list[tuple[int, str]]]]:
+    """Yields (problems, [(line number, error)]) for every :batch_size: rows of :lines:"""
+    problems, errors = [], []
+    for count, (line_number, row) in enumerate(read_rows(lines, fmt), start=1):
+        try:
+            if isinstance(row, ValueError):
+                raise row
+            problems.append(parse_problem(row))
+        except ValueError as e:
+            errors.append((line_number, str(e)))
+        if count % batch_size == 0:
+            yield problems, errors
+            problems, errors = [], []
+    if problems or errors:
+        yield problems, errors
+
+
+def load_problem_set(lines: Iterable[str], fmt: str) -> tuple[list[dict[str, Any]], list[tuple[int, str]]]:
+    """Reads and validates a whole problem set. Returns (problems, [(line number, error)])."""
+    problems, errors = [], []
+    for batch, batch_errors in read_problems(lines, fmt):
+        problems += batch
+        errors += batch_errors
+    return problems, errors
+
+
+def import_ops(start: int, problems: list[dict[str, Any]], batch_size: int = IMPORT_BATCH) -> Iterator[tuple]:
+    """Yields the journal operations that append :problems: at id :start:. Commit them as one batch."""
+    for offset in range(0, len(problems), batch_size):
+        yield 'problems', start + offset, problems[offset:offset + batch_size]
+
+
+class ProblemIndex:
+    """Problem ids by scheduled date and by tag. Ids themselves index the problem list."""
+
+    def __init__(self, problems: Iterable[dict[str, Any]] = ()):
+        self.rebuild(problems)
+
+    def rebuild(self, problems: Iterable[dict[str, Any]]) -> None:
+        self._by_date: list[tuple[Date, int]] = []  # sorted
+        self._by_tag: dict[str, list[int]] = {}  # sorted ids
+        self._dates: dict[int, Date] = {}
+        self._tags: dict[int, list[str]] = {}
+        for problem_id, problem in enumerate(problems):
+            self.set(problem_id, problem)
+
+    def set(self, problem_id: int, problem: dict[str, Any]) -> None:
+        """Indexes :problem: as :problem_id:, replacing what was indexed for that id"""
+        self._remove(problem_id)
+        if problem.get('date') is not None:
+            date = self._dates[problem_id] = tuple(problem['date'])
+            bisect.insort(self._by_date, (date, problem_id))
+        if problem.get('tags'):
+            self._tags[problem_id] = problem['tags']
+            for tag in problem['tags']:
+                bisect.insort(self._by_tag.setdefault(tag, []), problem_id)
+
+    def _remove(self, problem_id: int) -> None:
+        date = self._dates.pop(problem_id, None)
+        if date is not None:
+            del self._by_date[bisect.bisect_left(self._by_date, (date, problem_id))]
+        for tag in self._tags.pop(problem_id, ()):
+            ids = self._by_tag[tag]
+            del ids[bisect.bisect_left(ids, problem_id)]
+            if not ids:
+                del self._by_tag[tag]
+
+    def on_date(self, date: Date) -> list[int]:
+        """Returns the ids of the problems scheduled on :date:"""
+        i = bisect.bisect_left(self._by_date, (date,))
+        ids = []
+        while i < len(self._by_date) and self._by_date[i][0] == date:
+            ids.append(self._by_date[i][1])
+            i += 1
+        return ids
+
+    def scheduled_from(self, date: Date, limit: int) -> list[tuple[Date, int]]:
+        """Returns up to :limit: (date, id) pairs scheduled on or after :date:, earliest first"""
+        i = bisect.bisect_left(self._by_date, (date,))
+        return self._by_date[i:i + limit]
+
+    def with_tag(self, tag: str) -> list[int]:
+        return self._by_tag.get(tag.lower(), [])
+
+    def tag_counts(self) -> dict[str, int]:
+        return {tag: len(ids) for tag, ids in sorted(self._by_tag.items())}
+
+
+def main_cli(argv: list[str]) -> Optional[int]:
+    args = [arg for arg in argv if arg != '--check']
+    if len(args) not in (2, 3) or args[0] != 'import':
+        print('usage: python problembank.py import <problems.csv|problems.jsonl> [datafile] [--check]')
+        return 2
+    from storage import make_storage
+
+    logging.basicConfig(level=logging.INFO)
+    path = args[1]
+    with open(path, newline='', encoding='utf-8-sig') as f:
+        problems, errors = load_problem_set(f, detect_format(path))
+    for line_number, error in errors:
+        print(f'{path}:{line_number}: {error}')
+    if errors:
+        print(f'{len(errors)} errors, nothing was imported')
+        return 1
+    if not problems:
+        print('no problems found')
+        return 1
+    if '--check' in argv:
+        print(f'{len(problems)} problems are valid')
+        return None
+
+    with open('config.json', 'r') as f:
+        config = json.load(f)
+    if len(args) == 3:
+        config['datafile'] = args[2]
+    storage = make_storage(config)
+    storage.load()
+    start = len(storage.problems)
+    storage.commit(('batch', list(import_ops(start, problems))))
+    storage.snapshot()
+    storage.close()
+    print(f'imported {len(problems)} problems as #{start}-#{start + len(problems) - 1}')
+    return None
+
+
+if __name__ == '__main__':
+    sys.exit(main_cli(sys.argv[1:]))
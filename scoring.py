@@ -0,0 +1,80 @@
+"""
+
+OMMC PROBLEM OF THE DAY BOT - scoring
+
+How a problem's value and each solver's points are computed. Solvers of a problem
+share its value: a solver with k attempts left holds SHARES[k] shares, and the
+problem is worth problem_value(total shares) points per share.
+
+Every function works on plain numbers (the bot, one problem at a time) and on
+NumPy arrays (simulate.py, many problems and parameter sets at once) with the
+same arithmetic, so simulated points equal live points exactly. The total shares
+are summed per attempts-left bucket in a fixed order for the same reason.
+
+"""
+
+
+from typing import Any, Sequence
+
+from storage import MAX_ATTEMPTS
+
+SHARES = [
+    0,
+    0.15,  # 1 attempt left
+    0.35,
+    0.55,
+    0.75,
+    1.0,  # 5 attempts (first try)
+]
+VALUE_NUMERATOR = 3000.0
+VALUE_OFFSET = 6.0
+ESTIMATE_EXPONENT = 0.6  # how fast solves are assumed to slow down over the day
+PROBLEM_SECONDS = 86400.0  # how long a problem is normally open
+
+
+class ScoringParams:
+    """Parameters of the scoring curves.
+
+    Either plain numbers, or arrays with one entry per parameter set (shares then
+    has one row per attempts-left bucket, like SHARES).
+    """
+
+    shares: Sequence[Any]
+    numerator: Any
+    offset: Any
+    exponent: Any
+
+    def __init__(self, shares: Sequence[Any] = SHARES, numerator: Any = VALUE_NUMERATOR,
+                 offset: Any = VALUE_OFFSET, exponent: Any = ESTIMATE_EXPONENT):
+        self.shares = shares
+        self.numerator = numerator
+        self.offset = offset
+        self.exponent = exponent
+
+
+LIVE = ScoringParams()
+
+
+def share_total(solve_counts: Sequence[Any], params: ScoringParams = LIVE) -> Any:
+    """Returns the total shares of a problem. solve_counts[k] is the number of solvers with k attempts left."""
+    total = 0.0
+    for attempts_left in range(MAX_ATTEMPTS + 1):
+        total = total + solve_counts[attempts_left] * params.shares[attempts_left]
+    return total
+
+
+def problem_value(total_shares: Any, params: ScoringParams = LIVE) -> Any:
+    """Returns the points per share of a problem with :total_shares: shares"""
+    return params.numerator / (params.offset + total_shares)
+
+
+def estimated_value(total_shares: Any, elapsed_fraction: Any, params: ScoringParams = LIVE) -> Any:
+    """Estimates the final points per share from the shares after :elapsed_fraction: of the problem's time"""
+    return problem_value(total_shares / elapsed_fraction ** params.exponent, params)
+
+
+def award_table(solve_counts: Sequence[Any], params: ScoringParams = LIVE) -> list[Any]:
+    """Returns the points each solver gets, by attempts left, once the problem closes"""
+    value = problem_value(share_total(solve_counts, params), params)
+    # Points are rounded down; // works the same on floats and arrays
+    return [value * params.shares[attempts_left] // 1 for attempts_left in range(MAX_ATTEMPTS + 1)]
@@ -0,0 +1,271 @@
+"""
+
+OMMC PROBLEM OF THE DAY BOT - scoring simulator
+
+Replays a submission history through the scoring engine (scoring.py) under many
+parameter sets at once: SHARES, the numerator and offset of the problem value
+curve, and the exponent of the value estimate in `problemstatus`. Set #0 is always
+the live parameters, so its points are exactly what the bot awarded.
+
+For every set it reports the final leaderboard, how spread out the scores are (Gini
+coefficient, standard deviation, share of all points held by the top 10) and the
+mean relative error of the value estimate at a few points in each problem's day.
+
+The history is the bot's <datafile>.history, or a synthetic season. Parameter sets
+come from a JSON file (a list of objects with any of `shares`, `numerator`, `offset`,
+`exponent`; missing keys are the live values) and/or are sampled at random.
+
+Usage: python simulate.py [datafile | --synthetic USERS PROBLEMS] [--params sets.json] [--sample 1000]
+                          [--sort estimate_error] [--show 10] [--output results.json]
+
+"""
+
+
+import argparse
+import json
+import random
+import sys
+from typing import Any, Optional
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+import scoring
+from history import read_columns
+from scoring import ScoringParams
+from storage import MAX_ATTEMPTS
+
+ESTIMATE_FRACTIONS = (0.1, 0.25, 0.5, 0.75)  # points in a problem's day where the estimate is checked
+CHUNK_CELLS = 4_000_000  # solves x parameter sets scored at a time
+LEADERBOARD_SIZE = 10
+METRICS = ('estimate_error', 'gini', 'std', 'top_share', 'mean')
+
+
+def synthetic_history(users: int, problems: int, seed: int = 0) -> dict[str, Any]:
+    """Returns history columns for a season where users of varying skill attempt problems of varying difficulty"""
+    rng = np.random.default_rng(seed)
+    skill = rng.beta(2.0, 2.0, users)
+    rows = []
+    for problem_id in range(problems):
+        ease = rng.uniform(0.2, 0.9)
+        user_ids = np.flatnonzero(rng.random(users) < 0.6)  # who tries the problem today
+        p_correct = np.clip(skill[user_ids] * ease * 1.5, 0.02, 0.98)
+        tries = rng.geometric(p_correct)  # attempt number of the first correct answer
+        attempts = np.minimum(tries, MAX_ATTEMPTS)
+        first = rng.beta(0.7, 2.0, len(user_ids)) * scoring.PROBLEM_SECONDS
+        for user_id, count, solved_at, start in zip(user_ids, attempts, tries, first):
+            for attempt in range(1, count + 1):
+                elapsed = min(start + (attempt - 1) * rng.uniform(60, 1800), scoring.PROBLEM_SECONDS - 1)
+                rows.append((user_id, problem_id, attempt, attempt == solved_at, elapsed))
+    user_id, problem_id, attempt, correct, elapsed = (np.array(column) for column in zip(*rows))
+    return {
+        'user_id': user_id.astype('q'),
+        'problem_id': problem_id.astype('i'),
+        'attempt': attempt.astype('B'),
+        'correct': correct.astype('B'),
+        'time': elapsed.astype('d'),
+        'elapsed': elapsed.astype('f'),
+    }
+
+
+def first_solves(columns: dict[str, Any]) -> dict[str, Any]:
+    """Returns user, problem, attempts left and elapsed seconds of the first correct answer of each user to each problem"""
+    correct = np.flatnonzero(columns['correct'] == 1)
+    _, first = np.unique(np.stack([columns['user_id'][correct], columns['problem_id'][correct].astype(np.int64)], axis=1),
+                         axis=0, return_index=True)
+    rows = correct[np.sort(first)]
+    return {
+        'user_id': columns['user_id'][rows],
+        'problem_id': columns['problem_id'][rows].astype(np.int64),
+        'attempts_left': MAX_ATTEMPTS + 1 - columns['attempt'][rows].astype(np.int64),
+        'elapsed': columns['elapsed'][rows].astype(np.float64),
+    }
+
+
+def sample_param_sets(count: int, seed: int = 0) -> list[dict[str, Any]]:
+    """Returns :count: random parameter sets around the live ones. Shares grow with attempts left; a first try is 1 share."""
+    rng = random.Random(seed)
+    sets = []
+    for _ in range(count):
+        shares = sorted(rng.uniform(0.0, 1.0) for _ in range(MAX_ATTEMPTS - 1))
+        sets.append({
+            'shares': [0, *(round(share, 3) for share in shares), 1.0],
+            'numerator': round(scoring.VALUE_NUMERATOR * rng.uniform(0.5, 2.0), 1),
+            'offset': round(rng.uniform(1.0, 12.0), 2),
+            'exponent': round(rng.uniform(0.3, 1.0), 3),
+        })
+    return sets
+
+
+def stack_params(param_sets: list[dict[str, Any]]) -> ScoringParams:
+    """Returns ScoringParams holding one entry per set of :param_sets:"""
+    live = scoring.LIVE
+    shares = [list(param_set.get('shares', live.shares)) for param_set in param_sets]
+    for i, row in enumerate(shares):
+        if len(row) != MAX_ATTEMPTS + 1:
+            raise ValueError(f'parameter set #{i}: shares needs {MAX_ATTEMPTS + 1} values, one per attempts left')
+    return ScoringParams(
+        shares=np.array(shares, dtype=np.float64).T,
+        numerator=np.array([param_set.get('numerator', live.numerator) for param_set in param_sets], dtype=np.float64),
+        offset=np.array([param_set.get('offset', live.offset) for param_set in param_sets], dtype=np.float64),
+        exponent=np.array([param_set.get('exponent', live.exponent) for param_set in param_sets], dtype=np.float64),
+    )
+
+
+def chunk(params: ScoringParams, start: int, stop: int) -> ScoringParams:
+    return ScoringParams(params.shares[:, start:stop], params.numerator[start:stop],
+                         params.offset[start:stop], params.exponent[start:stop])
+
+
+def solve_counts(solves: dict[str, Any], problem_count: int, mask: Optional[Any] = None) -> Any:
+    """Returns solvers by (attempts left, problem), with a trailing axis to broadcast against parameter sets"""
+    counts = np.zeros((MAX_ATTEMPTS + 1, problem_count), dtype=np.int64)
+    attempts_left, problem_ids = solves['attempts_left'], solves['problem_id']
+    if mask is not None:
+        attempts_left, problem_ids = attempts_left[mask], problem_ids[mask]
+    np.add.at(counts, (attempts_left, problem_ids), 1)
+    return counts[:, :, None]
+
+
+def simulate(solves: dict[str, Any], params: ScoringParams, leaderboard_size: int = LEADERBOARD_SIZE) -> dict[str, Any]:
+    """Scores :solves: under every parameter set of :params:.
+
+    Returns the metrics (one value per set), the top :leaderboard_size: user ids and
+    their points per set, and every user's points under the live set (#0).
+    """
+    problem_count = int(solves['problem_id'].max()) + 1 if len(solves['problem_id']) else 0
+    user_ids, user_index = np.unique(solves['user_id'], return_inverse=True)
+    order = np.argsort(user_index, kind='stable')
+    starts = np.flatnonzero(np.diff(user_index[order], prepend=-1))
+    cells = (solves['attempts_left'] * problem_count + solves['problem_id'])[order]
+    counts = solve_counts(solves, problem_count)
+    partial_counts = [solve_counts(solves, problem_count, solves['elapsed'] <= fraction * scoring.PROBLEM_SECONDS)
+                      for fraction in ESTIMATE_FRACTIONS]
+    solved_problems = np.flatnonzero(counts.sum(axis=0)[:, 0])
+
+    set_count = len(params.numerator)
+    step = max(1, CHUNK_CELLS // max(len(cells), 1))
+    result = {name: np.empty(set_count) for name in METRICS}
+    top = min(leaderboard_size, len(user_ids))
+    leaders = np.empty((top, set_count), dtype=np.int64)
+    leader_points = np.empty((top, set_count), dtype=np.int64)
+    live_points = None
+    for start in range(0, set_count, step):
+        stop = min(start + step, set_count)
+        part = chunk(params, start, stop)
+        table = np.stack(scoring.award_table(counts, part))  # (attempts left, problem, set)
+        points = np.add.reduceat(table.reshape(-1, stop - start)[cells].astype(np.int64), starts, axis=0)
+        if start == 0:
+            live_points = points[:, 0].copy()
+
+        ranked = np.argsort(-points, axis=0, kind='stable')[:top]
+        leaders[:, start:stop] = user_ids[ranked]
+        leader_points[:, start:stop] = np.take_along_axis(points, ranked, axis=0)
+
+        ascending = np.sort(points, axis=0).astype(np.float64)
+        totals = ascending.sum(axis=0)
+        n = len(ascending)
+        weighted = (np.arange(1, n + 1)[:, None] * ascending).sum(axis=0)
+        safe_totals = np.where(totals > 0, totals, 1.0)
+        result['gini'][start:stop] = np.where(totals > 0, 2 * weighted / (n * safe_totals) - (n + 1) / n, 0.0)
+        result['std'][start:stop] = ascending.std(axis=0)
+        result['mean'][start:stop] = ascending.mean(axis=0)
+        result['top_share'][start:stop] = np.where(totals > 0, ascending[-top:].sum(axis=0) / safe_totals, 0.0)
+
+        final = scoring.problem_value(scoring.share_total(counts, part), part)[solved_problems]
+        errors = [np.abs(scoring.estimated_value(scoring.share_total(partial, part), fraction, part)[solved_problems]
+                         / final - 1.0).mean(axis=0) if len(solved_problems) else np.zeros(stop - start)
+                  for fraction, partial in zip(ESTIMATE_FRACTIONS, partial_counts)]
+        result['estimate_error'][start:stop] = np.mean(errors, axis=0)
+
+    return {
+        'metrics': result,
+        'leaders': leaders,
+        'leader_points': leader_points,
+        'users': user_ids,
+        'live_points': live_points,
+        'problem_count': problem_count,
+    }
+
+
+def format_set(param_set: dict[str, Any]) -> str:
+    live = scoring.LIVE
+    shares = '/'.join(f'{share:g}' for share in param_set.get('shares', live.shares)[1:])
+    return (f'shares={shares} value={param_set.get("numerator", live.numerator):g}/'
+            f'({param_set.get("offset", live.offset):g}+s) exponent={param_set.get("exponent", live.exponent):g}')
+
+
+def report(param_sets: list[dict[str, Any]], result: dict[str, Any], sort: str, show: int) -> None:
+    metrics = result['metrics']
+    order = [int(i) for i in np.argsort(metrics[sort], kind='stable')]
+    shown = [0] + [i for i in order if i != 0][:show]
+    print(f'{"set":>5} {"est.err":>8} {"gini":>6} {"std":>8} {"top10":>6} {"mean":>8}  {"leader":>20}  parameters')
+    for i in shown:
+        print(f'{"live" if i == 0 else f"#{i}":>5} {metrics["estimate_error"][i]:>8.1%} {metrics["gini"][i]:>6.3f} '
+              f'{metrics["std"][i]:>8.1f} {metrics["top_share"][i]:>6.1%} {metrics["mean"][i]:>8.1f}  '
+              f'{result["leaders"][0, i] if len(result["leaders"]) else "-":>20}  {format_set(param_sets[i])}')
+
+    best = next((i for i in order if i != 0), None)
+    print()
+    print(f'{"rank":>4}  {"live":>28}' + (f'  {f"first by {sort} (#{best})":>28}' if best is not None else ''))
+    for rank in range(len(result['leaders'])):
+        line = f'{rank + 1:>4}  {result["leaders"][rank, 0]:>20} {result["leader_points"][rank, 0]:>7}'
+        if best is not None:
+            line += f'  {result["leaders"][rank, best]:>20} {result["leader_points"][rank, best]:>7}'
+        print(line)
+
+
+def main_cli(argv: list[str]) -> Optional[int]:
+    parser = argparse.ArgumentParser(description='Replay a submission history under alternative scoring parameters')
+    parser.add_argument('datafile', nargs='?', default='data', help='replay <datafile>.history (default: data)')
+    parser.add_argument('--synthetic', nargs=2, type=int, metavar=('USERS', 'PROBLEMS'), help='replay a synthetic season instead')
+    parser.add_argument('--params', help='JSON file with a list of parameter sets')
+    parser.add_argument('--sample', type=int, default=0, help='add this many random parameter sets')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--sort', choices=METRICS, default='estimate_error', help='order of the sets shown')
+    parser.add_argument('--show', type=int, default=10, help='sets shown besides the live one')
+    parser.add_argument('--output', help='write every set with its metrics and leaderboard as JSON to this file')
+    args = parser.parse_args(argv)
+    if np is None:
+        print('the simulator needs NumPy (pip install numpy)')
+        return 1
+
+    if args.synthetic:
+        columns = synthetic_history(*args.synthetic, seed=args.seed)
+    else:
+        columns = read_columns(f'{args.datafile}.history')
+    solves = first_solves(columns)
+    if not len(solves['user_id']):
+        print('no correct answers to replay')
+        return 1
+
+    param_sets = [{}]
+    if args.params:
+        with open(args.params) as f:
+            param_sets += json.load(f)
+    param_sets += sample_param_sets(args.sample, args.seed)
+    try:
+        params = stack_params(param_sets)
+    except ValueError as e:
+        print(e)
+        return 1
+    result = simulate(solves, params)
+    print(f'{len(columns["user_id"])} submissions, {len(solves["user_id"])} solves by {len(result["users"])} users '
+          f'on {result["problem_count"]} problems, {len(param_sets)} parameter sets\n')
+    report(param_sets, result, args.sort, args.show)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump([{
+                'params': param_set,
+                **{name: float(result['metrics'][name][i]) for name in METRICS},
+                'leaderboard': [[int(user_id), int(points)]
+                                for user_id, points in zip(result['leaders'][:, i], result['leader_points'][:, i])],
+            } for i, param_set in enumerate(param_sets)], f, indent=1)
+    return None
+
+
+if __name__ == '__main__':
+    sys.exit(main_cli(sys.argv[1:]))
@@ -0,0 +1,558 @@
+"""
+
+OMMC PROBLEM OF THE DAY BOT - persistence
+
+Every mutation of users, attempts, problems and state is expressed as an
+operation (see below) and handed to a storage backend:
+
+JournaledStorage - pickled snapshot plus an append-only journal of operations.
+    Everything is kept in memory.
+SQLiteStorage - SQLite database in WAL mode. Users stay on disk, and ranks and
+    leaderboard pages are queried from the totalscore index.
+
+Users only hold totals. Attempts on the current problem are kept separately
+and dropped when the problem closes.
+
+Run `python storage.py migrate [datafile]` to copy data.pickle (+ journal) into
+SQLite. Pass the season's `datafile` (e.g. data-amc10) to migrate one season.
+
+"""
+
+
+import bisect
+import json
+import logging
+import math
+import os
+import pickle
+import sqlite3
+import sys
+from typing import Any, Iterable, Iterator, Mapping, Optional
+
+# Journal operations. Every operation sets absolute values, so replaying an
+# operation that is already reflected in the snapshot is harmless.
+#   ('user', user_id, fields)     merge :fields: into a user, creating it if needed
+#   ('users', fields)             merge :fields: into every user
+#   ('attempt', user_id, fields)  merge :fields: into a user's attempt on the current problem
+#   ('clearattempts',)            delete all attempts on the current problem
+#   ('problem', index, problem)   set (or append) the problem at :index:
+#   ('problems', index, problems) set (or append) :problems: from :index: on
+#   ('clearproblems',)            delete all problems
+#   ('state', fields)             merge :fields: into the state
+#   ('batch', ops)                apply :ops: in order, all or none of them
+Op = tuple
+
+FSYNC_BATCH = 64
+SNAPSHOT_EVERY = 5000
+
+
+MAX_ATTEMPTS = 5
+LEGACY_ATTEMPT_FIELDS = frozenset(('answered', 'attemptsleft'))  # kept in the user records before attempts were split out
+
+
+def get_default_user_data() -> dict[str, Any]:
+    return {
+        'totalscore': 0,
+    }
+
+
+def get_default_attempt() -> dict[str, Any]:
+    return {
+        'answered': False,
+        'attemptsleft': MAX_ATTEMPTS,
+    }
+
+
+def get_default_data() -> dict[str, Any]:
+    return {
+        'problems': [],
+        'users': {},
+        'attempts': {},
+        'state': {
+            'currentproblemid': 0,
+            'lastreset': [1970, 1, 1],  # year, month, day, hour (in UTC)
+        },
+    }
+
+
+def apply_op(data: dict[str, Any], op: Op) -> None:
+    """Applies the journal operation :op: to :data: in place."""
+    kind = op[0]
+    if kind == 'user':
+        _, user_id, fields = op
+        if not LEGACY_ATTEMPT_FIELDS.isdisjoint(fields):
+            # Journaled by a version that kept attempts in the user records
+            fields = dict(fields)
+            apply_op(data, ('attempt', user_id, {key: fields.pop(key) for key in LEGACY_ATTEMPT_FIELDS if key in fields}))
+        data['users'].setdefault(user_id, get_default_user_data()).update(fields)
+    elif kind == 'users':
+        fields = op[1]
+        if not LEGACY_ATTEMPT_FIELDS.isdisjoint(fields):
+            # Older versions reset every user's attempts this way
+            data['attempts'].clear()
+            fields = {key: value for key, value in fields.items() if key not in LEGACY_ATTEMPT_FIELDS}
+        for user_data in data['users'].values():
+            user_data.update(fields)
+    elif kind == 'attempt':
+        _, user_id, fields = op
+        data['attempts'].setdefault(user_id, get_default_attempt()).update(fields)
+    elif kind == 'clearattempts':
+        data['attempts'].clear()
+    elif kind == 'problem':
+        _, index, problem = op
+        if index < len(data['problems']):
+            data['problems'][index] = problem
+        else:
+            data['problems'].append(problem)
+    elif kind == 'problems':
+        _, index, problems = op
+        for problem_index, problem in enumerate(problems, start=index):
+            apply_op(data, ('problem', problem_index, problem))
+    elif kind == 'clearproblems':
+        data['problems'].clear()
+    elif kind == 'state':
+        data['state'].update(op[1])
+    elif kind == 'batch':
+        for batch_op in op[1]:
+            apply_op(data, batch_op)
+    else:
+        raise ValueError(f'unknown journal operation {kind!r}')
+
+
+def split_attempts(data: dict[str, Any]) -> bool:
+    """Moves answered/attemptsleft out of user records saved by older versions into data['attempts'].
+    Returns whether there was anything to move."""
+    attempts = data.setdefault('attempts', {})
+    converted = False
+    for user_id, user_data in data['users'].items():
+        if LEGACY_ATTEMPT_FIELDS.isdisjoint(user_data):
+            continue
+        converted = True
+        answered = user_data.pop('answered', False)
+        attemptsleft = user_data.pop('attemptsleft', MAX_ATTEMPTS)
+        if answered or attemptsleft != MAX_ATTEMPTS:
+            attempts[user_id] = {'answered': answered, 'attemptsleft': attemptsleft}
+    return converted
+
+
+class Journal:
+    """Append-only file of pickled operations.
+
+    Every record is flushed to the OS as soon as it is appended, so killing the
+    process loses nothing. fsync is batched: it runs every :FSYNC_BATCH: records
+    or whenever sync() is called.
+    """
+
+    path: str
+    size: int
+
+    def __init__(self, path: str):
+        self.path = path
+        self.size = 0
+        self._unsynced = 0
+        self._file = open(path, 'ab')
+
+    @staticmethod
+    def replay(path: str) -> Iterator[Op]:
+        """Yields every complete operation in the journal at :path:.
+
+        A torn record at the end (from a crash in the middle of a write) is cut off.
+        """
+        try:
+            f = open(path, 'rb')
+        except FileNotFoundError:
+            return
+        with f:
+            good_offset = 0
+            while True:
+                try:
+                    op = pickle.load(f)
+                except EOFError:
+                    break
+                except (pickle.UnpicklingError, ValueError, TypeError, IndexError):
+                    break
+                good_offset = f.tell()
+                yield op
+            if os.path.getsize(path) > good_offset:
+                logging.warning(f'journal {path} has a torn record at offset {good_offset}, truncating')
+                os.truncate(path, good_offset)
+
+    def append(self, op: Op) -> None:
+        pickle.dump(op, self._file, protocol=pickle.HIGHEST_PROTOCOL)
+        self._file.flush()
+        self.size += 1
+        self._unsynced += 1
+        if self._unsynced >= FSYNC_BATCH:
+            self.sync()
+
+    def sync(self) -> None:
+        """Forces appended records to disk"""
+        if self._unsynced == 0:
+            return
+        os.fsync(self._file.fileno())
+        self._unsynced = 0
+
+    def truncate(self) -> None:
+        self._file.truncate(0)
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self.size = 0
+        self._unsynced = 0
+
+    def close(self) -> None:
+        self.sync()
+        self._file.close()
+
+
+class RankIndex:
+    """Users ordered by descending total score, ties broken by user id.
+
+    Kept as a sorted list of (-score, user id) keys, so a rank is one bisect and a
+    leaderboard page is one slice. A score change moves one key.
+    """
+
+    def __init__(self, scores: Iterable[tuple[int, int]] = ()):
+        self.rebuild(scores)
+
+    def rebuild(self, scores: Iterable[tuple[int, int]]) -> None:
+        self._scores = dict(scores)
+        self._keys = sorted((-score, user_id) for user_id, score in self._scores.items())
+
+    def update(self, user_id: int, score: int) -> None:
+        old_score = self._scores.get(user_id)
+        if old_score == score:
+            return
+        if old_score is not None:
+            del self._keys[bisect.bisect_left(self._keys, (-old_score, user_id))]
+        self._scores[user_id] = score
+        bisect.insort(self._keys, (-score, user_id))
+
+    def rank(self, user_id: int) -> Optional[int]:
+        """Returns the 0-based position of a user, or None if the user has no score"""
+        score = self._scores.get(user_id)
+        if score is None:
+            return None
+        return bisect.bisect_left(self._keys, (-score, user_id))
+
+    def count_at_least(self, score: int) -> int:
+        """Returns the number of users with a score of at least :score:"""
+        return bisect.bisect_right(self._keys, (-score, math.inf))
+
+    def page(self, offset: int, limit: int) -> list[tuple[int, int]]:
+        """Returns up to :limit: (user id, score) pairs starting at position :offset:"""
+        return [(user_id, -neg_score) for neg_score, user_id in self._keys[offset:offset+limit]]
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+
+class Storage:
+    """Interface shared by the storage backends"""
+
+    problems: list[dict[str, Any]]
+    users: Mapping[int, dict[str, Any]]
+    attempts: dict[int, dict[str, Any]]
+    state: dict[str, Any]
+
+    def load(self) -> None:
+        """Loads data, making problems/users/attempts/state available"""
+        raise NotImplementedError
+
+    def commit(self, op: Op) -> None:
+        """Applies and persists the operation :op:"""
+        raise NotImplementedError
+
+    def sync(self) -> None:
+        """Makes previously committed operations durable"""
+
+    def snapshot(self) -> int:
+        """Compacts storage. Returns the size of the stored data in bytes."""
+        raise NotImplementedError
+
+    def close(self) -> None:
+        pass
+
+    def rank_index(self) -> 'RankIndex':
+        """Returns an index of the users by descending total score, kept up to date through Main.commit"""
+        raise NotImplementedError
+
+
+class JournaledStorage(Storage):
+    """Pickle snapshot + journal of the operations applied since that snapshot"""
+
+    snapshot_path: str
+    journal: Journal
+    data: dict[str, Any]
+
+    def __init__(self, snapshot_path: str = 'data.pickle', journal_path: str = 'data.journal'):
+        self.snapshot_path = snapshot_path
+        self.journal_path = journal_path
+
+    def load(self) -> None:
+        """Loads the last snapshot and replays the journal on top of it"""
+        try:
+            with open(self.snapshot_path, 'rb') as f:
+                self.data = pickle.load(f)
+        except FileNotFoundError:
+            self.data = get_default_data()
+        # The journal was written on top of the converted data, so convert before replaying it
+        converted = split_attempts(self.data)
+        replayed = 0
+        for op in Journal.replay(self.journal_path):
+            apply_op(self.data, op)
+            replayed += 1
+        logging.info(f'loaded snapshot {self.snapshot_path} and replayed {replayed} journal records')
+        self.journal = Journal(self.journal_path)
+        self.journal.size = replayed
+        self.problems = self.data['problems']
+        self.users = self.data['users']
+        self.attempts = self.data['attempts']
+        self.state = self.data['state']
+        if converted:
+            # Never load the old format again, so it cannot be converted on top of newer journal records
+            self.snapshot()
+            logging.info(f'moved attempts out of the user records in {self.snapshot_path}')
+
+    def commit(self, op: Op) -> None:
+        """Applies :op: to the data and appends it to the journal"""
+        apply_op(self.data, op)
+        self.journal.append(op)
+        if self.journal.size >= SNAPSHOT_EVERY:
+            self.snapshot()
+
+    def sync(self) -> None:
+        self.journal.sync()
+
+    def snapshot(self) -> int:
+        """Writes a full snapshot atomically and empties the journal. Returns the snapshot size in bytes."""
+        tmp_path = f'{self.snapshot_path}.tmp'
+        with open(tmp_path, 'wb') as f:
+            pickle.dump(self.data, f, protocol=pickle.HIGHEST_PROTOCOL)
+            f.flush()
+            os.fsync(f.fileno())
+            size = f.tell()
+        os.replace(tmp_path, self.snapshot_path)
+        self.journal.truncate()
+        return size
+
+    def close(self) -> None:
+        self.journal.close()
+
+    def rank_index(self) -> 'RankIndex':
+        return RankIndex((user_id, user_data['totalscore']) for user_id, user_data in self.users.items())
+
+
+class UserTable(Mapping):
+    """Read-only mapping view of the users table. Writes go through SQLiteStorage.commit."""
+
+    def __init__(self, db: sqlite3.Connection, columns: list[str]):
+        self._db = db
+        self._columns = columns
+        self._select = ', '.join(columns)
+
+    def _row_to_dict(self, row: tuple) -> dict[str, Any]:
+        return dict(zip(self._columns, row))
+
+    def __getitem__(self, user_id: int) -> dict[str, Any]:
+        row = self._db.execute(f'SELECT {self._select} FROM users WHERE user_id = ?', (user_id,)).fetchone()
+        if row is None:
+            raise KeyError(user_id)
+        return self._row_to_dict(row)
+
+    def __contains__(self, user_id: object) -> bool:
+        return self._db.execute('SELECT 1 FROM users WHERE user_id = ?', (user_id,)).fetchone() is not None
+
+    def __iter__(self) -> Iterator[int]:
+        return iter([row[0] for row in self._db.execute('SELECT user_id FROM users')])
+
+    def __len__(self) -> int:
+        return self._db.execute('SELECT COUNT(*) FROM users').fetchone()[0]
+
+    def items(self) -> list[tuple[int, dict[str, Any]]]:
+        rows = self._db.execute(f'SELECT user_id, {self._select} FROM users').fetchall()
+        return [(row[0], self._row_to_dict(row[1:])) for row in rows]
+
+    def values(self) -> list[dict[str, Any]]:
+        return [self._row_to_dict(row) for row in self._db.execute(f'SELECT {self._select} FROM users')]
+
+
+class SQLiteStorage(Storage):
+    """SQLite database in WAL mode.
+
+    Problems, attempts and state are small and cached in memory; users are only read on demand.
+    """
+
+    path: str
+    db: sqlite3.Connection
+
+    def __init__(self, path: str = 'data.sqlite3'):
+        self.path = path
+        self.user_columns = list(get_default_user_data())
+
+    def load(self) -> None:
+        self.db = sqlite3.connect(self.path, isolation_level=None)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('PRAGMA synchronous=NORMAL')
+        user_columns = ', '.join(f'{column} INTEGER NOT NULL' for column in self.user_columns)
+        self.db.executescript(f"""
+            CREATE TABLE IF NOT EXISTS users (user_id INTEGER PRIMARY KEY, {user_columns});
+            CREATE INDEX IF NOT EXISTS users_totalscore ON users (totalscore DESC, user_id);
+            CREATE TABLE IF NOT EXISTS attempts (user_id INTEGER PRIMARY KEY, answered INTEGER NOT NULL, attemptsleft INTEGER NOT NULL);
+            CREATE TABLE IF NOT EXISTS problems (id INTEGER PRIMARY KEY, data TEXT NOT NULL);
+            CREATE TABLE IF NOT EXISTS state (key TEXT PRIMARY KEY, value TEXT NOT NULL);
+        """)
+        self._split_attempts()
+        self.attempts = {user_id: {'answered': bool(answered), 'attemptsleft': attemptsleft}
+                         for user_id, answered, attemptsleft in self.db.execute('SELECT * FROM attempts')}
+        self.problems = [json.loads(row[0]) for row in self.db.execute('SELECT data FROM problems ORDER BY id')]
+        self.state = get_default_data()['state']
+        self.state.update((key, json.loads(value)) for key, value in self.db.execute('SELECT key, value FROM state'))
+        self.users = UserTable(self.db, self.user_columns)
+        logging.info(f'opened {self.path} ({len(self.problems)} problems, {len(self.users)} users)')
+
+    def _split_attempts(self) -> None:
+        """Moves answered/attemptsleft out of a users table created by older versions"""
+        columns = [row[1] for row in self.db.execute('PRAGMA table_info(users)')]
+        if 'answered' not in columns:
+            return
+        self.db.execute('BEGIN')
+        self.db.execute('INSERT OR REPLACE INTO attempts SELECT user_id, answered, attemptsleft FROM users '
+                        'WHERE answered OR attemptsleft != ?', (MAX_ATTEMPTS,))
+        self.db.execute('ALTER TABLE users DROP COLUMN answered')
+        self.db.execute('ALTER TABLE users DROP COLUMN attemptsleft')
+        self.db.execute('COMMIT')
+        logging.info('moved attempts out of the users table')
+
+    def _check_columns(self, fields: dict[str, Any]) -> None:
+        for column in fields:
+            if column not in self.user_columns:
+                raise ValueError(f'unknown user field {column!r}')
+
+    def commit(self, op: Op) -> None:
+        if op[0] in ('batch', 'problems'):
+            # One transaction, so a crash leaves all of the operation or none of it
+            self.db.execute('BEGIN')
+            try:
+                self._execute(op)
+            except BaseException:
+                self.db.execute('ROLLBACK')
+                raise
+            self.db.execute('COMMIT')
+        else:
+            self._execute(op)
+        self._apply(op)
+
+    def _execute(self, op: Op) -> None:
+        """Writes :op: to the database"""
+        kind = op[0]
+        if kind == 'user':
+            _, user_id, fields = op
+            self._check_columns(fields)
+            row = get_default_user_data() | fields
+            placeholders = ', '.join('?' * (len(row) + 1))
+            assignments = ', '.join(f'{column} = excluded.{column}' for column in fields)
+            self.db.execute(f'INSERT INTO users (user_id, {", ".join(row)}) VALUES ({placeholders}) '
+                            f'ON CONFLICT (user_id) DO {"UPDATE SET " + assignments if fields else "NOTHING"}',
+                            (user_id, *row.values()))
+        elif kind == 'users':
+            self._check_columns(op[1])
+            assignments = ', '.join(f'{column} = ?' for column in op[1])
+            self.db.execute(f'UPDATE users SET {assignments}', tuple(op[1].values()))
+        elif kind == 'attempt':
+            _, user_id, fields = op
+            attempt = self.attempts.get(user_id, get_default_attempt()) | fields
+            self.db.execute('INSERT OR REPLACE INTO attempts (user_id, answered, attemptsleft) VALUES (?, ?, ?)',
+                            (user_id, attempt['answered'], attempt['attemptsleft']))
+        elif kind == 'clearattempts':
+            self.db.execute('DELETE FROM attempts')
+        elif kind == 'problem':
+            _, index, problem = op
+            self.db.execute('INSERT OR REPLACE INTO problems (id, data) VALUES (?, ?)', (index, json.dumps(problem)))
+        elif kind == 'problems':
+            _, index, problems = op
+            self.db.executemany('INSERT OR REPLACE INTO problems (id, data) VALUES (?, ?)',
+                                ((problem_index, json.dumps(problem)) for problem_index, problem in enumerate(problems, start=index)))
+        elif kind == 'clearproblems':
+            self.db.execute('DELETE FROM problems')
+        elif kind == 'state':
+            self.db.executemany('INSERT OR REPLACE INTO state (key, value) VALUES (?, ?)',
+                                [(key, json.dumps(value)) for key, value in op[1].items()])
+        elif kind == 'batch':
+            for batch_op in op[1]:
+                self._execute(batch_op)
+        else:
+            raise ValueError(f'unknown journal operation {kind!r}')
+
+    def _apply(self, op: Op) -> None:
+        """Applies :op: to the problems, attempts and state kept in memory. Users are read from the database."""
+        if op[0] == 'batch':
+            for batch_op in op[1]:
+                self._apply(batch_op)
+        elif op[0] != 'user' and op[0] != 'users':
+            apply_op({'problems': self.problems, 'attempts': self.attempts, 'state': self.state}, op)
+
+    def snapshot(self) -> int:
+        self.db.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+        return os.path.getsize(self.path)
+
+    def close(self) -> None:
+        self.db.close()
+
+    def rank_index(self) -> 'RankIndex':
+        # Kept in memory even though users stay on disk: about 200 bytes per user, but a rank is
+        # one bisect. Counting rows above a user in the users_totalscore index costs O(rank), and
+        # a Fenwick tree of scores still counts ties row by row, e.g. everyone at 0 after a reset.
+        return RankIndex(self.db.execute('SELECT user_id, totalscore FROM users'))
+
+
+def make_storage(config: dict[str, Any]) -> Storage:
+    """Creates the storage backend selected by the `storage` config key ('pickle' or 'sqlite').
+
+    Files are named after the `datafile` config key, 'data' by default.
+    """
+    backend = config.get('storage', 'pickle')
+    stem = config.get('datafile', 'data')
+    snapshot_path, journal_path, db_path = f'{stem}.pickle', f'{stem}.journal', f'{stem}.sqlite3'
+    if backend == 'pickle':
+        return JournaledStorage(snapshot_path, journal_path)
+    if backend == 'sqlite':
+        if not os.path.exists(db_path) and (os.path.exists(snapshot_path) or os.path.exists(journal_path)):
+            migrate_pickle_to_sqlite(snapshot_path, journal_path, db_path)
+        return SQLiteStorage(db_path)
+    raise ValueError(f'unknown storage backend {backend!r}')
+
+
+def migrate_pickle_to_sqlite(snapshot_path: str, journal_path: str, db_path: str) -> None:
+    """Copies the pickle snapshot (with its journal replayed) into a new SQLite database"""
+    if os.path.exists(db_path):
+        raise FileExistsError(f'{db_path} already exists, refusing to overwrite it')
+    source = JournaledStorage(snapshot_path, journal_path)
+    source.load()
+    target = SQLiteStorage(db_path)
+    target.load()
+    columns = target.user_columns
+    target.db.execute('BEGIN')
+    target.db.executemany(f'INSERT INTO users (user_id, {", ".join(columns)}) VALUES ({", ".join("?" * (len(columns) + 1))})',
+                          ((user_id, *(int(user_data[column]) for column in columns))
+                           for user_id, user_data in source.users.items()))
+    target.db.executemany('INSERT INTO attempts (user_id, answered, attemptsleft) VALUES (?, ?, ?)',
+                          ((user_id, attempt['answered'], attempt['attemptsleft'])
+                           for user_id, attempt in source.attempts.items()))
+    target.db.executemany('INSERT INTO problems (id, data) VALUES (?, ?)',
+                          ((i, json.dumps(problem)) for i, problem in enumerate(source.problems)))
+    target.db.executemany('INSERT INTO state (key, value) VALUES (?, ?)',
+                          ((key, json.dumps(value)) for key, value in source.state.items()))
+    target.db.execute('COMMIT')
+    target.snapshot()
+    logging.info(f'migrated {len(source.users)} users and {len(source.problems)} problems to {db_path}')
+    source.close()
+    target.close()
+
+
+if __name__ == '__main__':
+    if sys.argv[1:2] == ['migrate'] and len(sys.argv) <= 3:
+        logging.basicConfig(level=logging.INFO)
+        stem = sys.argv[2] if len(sys.argv) == 3 else 'data'
+        migrate_pickle_to_sqlite(f'{stem}.pickle', f'{stem}.journal', f'{stem}.sqlite3')
+    else:
+        print('usage: python storage.py migrate [datafile]')
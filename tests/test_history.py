@@ -0,0 +1,55 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import history  # noqa: E402
+
+pytestmark = pytest.mark.skipif(history.np is None, reason='needs NumPy')
+
+
+def record_rows(submissions: history.SubmissionHistory) -> None:
+    submissions.record(1, 0, 1, True, 1000.0, 60.0)
+    submissions.record(2, 0, 1, False, 1001.0, 61.0)
+    submissions.record(2, 0, 2, True, 1002.0, 120.0)
+    submissions.record(1, 1, 1, True, 2000.0, 30.0)
+
+
+@pytest.mark.parametrize('cleared', [False, True])
+def test_stats_without_full_segments(tmp_path, cleared):
+    submissions = history.SubmissionHistory(str(tmp_path / 'data.history'))
+    submissions.load()
+    if cleared:
+        record_rows(submissions)
+        submissions.columns()
+        submissions.clear()
+    record_rows(submissions)
+
+    columns = submissions.columns()
+    assert len(columns['user_id']) == 4
+
+    stats = history.problem_stats(columns, 0)
+    assert stats['submissions'] == 3
+    assert stats['attempters'] == 2
+    assert stats['solvers'] == 2
+    assert stats['attempts'][:2] == [1, 1]
+
+    assert [row[0] for row in history.difficulty(columns)] == [0, 1]
+
+    user = history.user_stats(columns, 1, 1)
+    assert user['solved'] == 2
+    assert user['current_streak'] == 2
+    submissions.close()
+
+
+def test_columns_span_full_segments(tmp_path):
+    submissions = history.SubmissionHistory(str(tmp_path / 'data.history'))
+    submissions.load()
+    for i in range(history.SEGMENT_ROWS + 3):
+        submissions.record(i, 0, 1, True, float(i), 1.0)
+    assert len(submissions.columns()['user_id']) == history.SEGMENT_ROWS + 3
+    submissions.record(-1, 0, 1, False, 0.0, 1.0)
+    assert len(submissions.columns()['user_id']) == history.SEGMENT_ROWS + 4
+    submissions.close()
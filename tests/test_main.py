@@ -0,0 +1,132 @@
+import asyncio
+import datetime
+import os
+import pickle
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'benchmarks'))
+
+pytest.importorskip('discord')
+
+import main  # noqa: E402
+import storage  # noqa: E402
+from fakediscord import FakeBot, FakeGuild, FakeMessage, FakeNetwork  # noqa: E402
+
+GUILD_ID = 1
+PROBLEM_CHANNEL_ID = 2
+SOLVED_ROLE_ID = 3
+
+
+def make_season(tmp_path, problem_count=3):
+    """Returns (Main, FakeBot) for a season whose first problem is open, with no network latency"""
+    network = FakeNetwork(latency=0.0, jitter=0.0)
+    bot = FakeBot(network, FakeGuild(network, GUILD_ID, [SOLVED_ROLE_ID]))
+    bot.add_channel(PROBLEM_CHANNEL_ID)
+    stem = str(tmp_path / 'data')
+    data = storage.get_default_data()
+    data['problems'] = [{'imageurl': 'https://example.com/problem.png', 'answer': str(i), 'answerformat': 'integer'}
+                        for i in range(problem_count)]
+    # Opened yesterday, so a reset run now is the one scheduled for today
+    data['state']['lastreset'] = list((datetime.date.today() - datetime.timedelta(days=1)).timetuple()[:3])
+    with open(f'{stem}.pickle', 'wb') as f:
+        pickle.dump(data, f)
+    config = {'name': 'test', 'datafile': stem, 'guildid': GUILD_ID, 'problemchannel': PROBLEM_CHANNEL_ID,
+              'solvedrole': SOLVED_ROLE_ID, 'checkimages': False}
+    return main.Main(bot, main.Lookup(bot), config), bot
+
+
+async def solve(season, bot, user_id):
+    user = bot.add_user(user_id)
+    await season.on_answer(FakeMessage(user, '0', user.dm_channel), '0')
+    user_id, channel, problem_id = season.role_grants.get_nowait()
+    member = bot.guild.members[user_id]
+    member.roles.append(bot.guild.get_role(SOLVED_ROLE_ID))
+    return member
+
+
+def test_next_problem_with_departed_solver(tmp_path):
+    async def run():
+        season, bot = make_season(tmp_path)
+        stayed = await solve(season, bot, 10)
+        await solve(season, bot, 11)
+        del bot.guild.members[11]  # left the guild during the day
+
+        await season.next_problem(0)
+        assert season.state['currentproblemid'] == 1
+        assert len(bot.channels[PROBLEM_CHANNEL_ID].sent) == 1
+        assert stayed.roles == []
+        assert all(season.users[user_id]['totalscore'] > 0 for user_id in (10, 11))
+        assert len(bot.users[11].dm_channel.sent) == 2  # the verdict and the points
+
+    asyncio.run(run())
+
+
+def test_concurrent_transitions_advance_once(tmp_path):
+    async def run():
+        season, bot = make_season(tmp_path)
+        await solve(season, bot, 10)
+        # forcenextproblem and the scheduler both try to close problem #0
+        await asyncio.gather(season.next_problem(0), season.next_problem(0))
+        assert season.state['currentproblemid'] == 1
+        assert len(bot.channels[PROBLEM_CHANNEL_ID].sent) == 1
+
+    asyncio.run(run())
+
+
+def test_role_grant_in_flight_during_reset(tmp_path):
+    async def run():
+        season, bot = make_season(tmp_path)
+        member = bot.add_user(10)
+        await season.on_answer(FakeMessage(member, '0', member.dm_channel), '0')
+
+        looked_up, release = asyncio.Event(), asyncio.Event()
+        member_lookup = season.lookup.member
+
+        async def slow_member(guild, user_id):
+            looked_up.set()
+            await release.wait()
+            return await member_lookup(guild, user_id)
+
+        season.lookup.member = slow_member
+        worker = asyncio.create_task(season.role_grant_worker())
+        await looked_up.wait()
+        season.lookup.member = member_lookup
+        await season.next_problem(0)  # closes the problem while the grant is looking up the member
+        release.set()
+        await season.role_grants.join()
+        worker.cancel()
+        assert member.roles == []
+
+    asyncio.run(run())
+
+
+def test_repost_keeps_the_next_staged_post(tmp_path):
+    async def run():
+        season, bot = make_season(tmp_path)
+        await season.stage_next_post()
+        staged = season.staged_post
+        await season.post_question()  # postagain shortly before the reset
+        assert season.staged_post is staged
+        assert season.is_next_post_staged()
+
+        await season.next_problem(0)
+        assert season.staged_post is None
+        assert bot.channels[PROBLEM_CHANNEL_ID].sent[-1]['embed'] is staged.embed
+
+    asyncio.run(run())
+
+
+def test_failing_dispatch_job_fails_only_itself():
+    async def broken() -> None:
+        raise AttributeError('bug')
+
+    async def run():
+        dispatcher = main.Dispatcher('test', 2)
+        dispatcher.add('broken', broken)
+        dispatcher.add('fine', lambda: asyncio.sleep(0))
+        return await dispatcher.run()
+
+    assert asyncio.run(run()) == (1, 1)
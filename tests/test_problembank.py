@@ -0,0 +1,28 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import problembank  # noqa: E402
+import storage  # noqa: E402
+
+
+def test_detect_format():
+    assert problembank.detect_format('set.CSV') == 'csv'
+    assert problembank.detect_format('set.jsonl') == 'jsonl'
+    with pytest.raises(ValueError):
+        problembank.detect_format('set.json')  # a JSON array, not JSON Lines
+
+
+def test_import_is_one_transaction(tmp_path):
+    problems = [{'imageurl': f'https://example.com/{i}.png', 'answer': str(i), 'answerformat': 'integer'}
+                for i in range(problembank.IMPORT_BATCH * 2 + 1)]
+    problems[-1] = {'unserializable': object()}  # fails while the last chunk is written
+    data = storage.SQLiteStorage(str(tmp_path / 'data.sqlite3'))
+    data.load()
+    with pytest.raises(TypeError):
+        data.commit(('batch', list(problembank.import_ops(0, problems))))
+    assert data.db.execute('SELECT COUNT(*) FROM problems').fetchone()[0] == 0
+    data.close()
@@ -0,0 +1,132 @@
+import os
+import pickle
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import storage  # noqa: E402
+
+
+def write_old_snapshot(path: str) -> None:
+    data = storage.get_default_data()
+    del data['attempts']
+    data['users'] = {
+        1: {'totalscore': 10, 'answered': False, 'attemptsleft': 3},
+        2: {'totalscore': 20, 'answered': True, 'attemptsleft': 5},
+    }
+    with open(path, 'wb') as f:
+        pickle.dump(data, f)
+
+
+def test_journal_replays_over_converted_old_snapshot(tmp_path):
+    snapshot_path, journal_path = str(tmp_path / 'data.pickle'), str(tmp_path / 'data.journal')
+    write_old_snapshot(snapshot_path)
+    journal = storage.Journal(journal_path)
+    journal.append(('attempt', 1, {'answered': True, 'attemptsleft': 3}))
+    journal.append(('attempt', 3, {'answered': False, 'attemptsleft': 4}))
+    journal.close()  # killed before any snapshot
+
+    data = storage.JournaledStorage(snapshot_path, journal_path)
+    data.load()
+    assert data.attempts[1] == {'answered': True, 'attemptsleft': 3}
+    assert data.attempts[2] == {'answered': True, 'attemptsleft': 5}
+    assert data.users[1] == {'totalscore': 10}
+    data.close()
+
+    # The conversion was snapshotted, so a later clear is not undone by the old user records
+    data = storage.JournaledStorage(snapshot_path, journal_path)
+    data.load()
+    data.commit(('clearattempts',))
+    data.close()
+    data = storage.JournaledStorage(snapshot_path, journal_path)
+    data.load()
+    assert data.attempts == {}
+    data.close()
+
+
+def test_old_journal_records_replay_in_order(tmp_path):
+    snapshot_path, journal_path = str(tmp_path / 'data.pickle'), str(tmp_path / 'data.journal')
+    write_old_snapshot(snapshot_path)
+    journal = storage.Journal(journal_path)
+    journal.append(('user', 1, {'answered': True}))
+    journal.append(('users', {'answered': False, 'attemptsleft': storage.MAX_ATTEMPTS}))
+    journal.append(('user', 2, {'attemptsleft': 4, 'totalscore': 25}))
+    journal.close()
+
+    data = storage.JournaledStorage(snapshot_path, journal_path)
+    data.load()
+    assert data.attempts == {2: {'answered': False, 'attemptsleft': 4}}
+    assert data.users[2] == {'totalscore': 25}
+    data.close()
+
+
+def reset_op(current_problem_id: int) -> tuple:
+    return ('batch', [
+        ('user', 1, {'totalscore': 110}),
+        ('user', 2, {'totalscore': 220}),
+        ('clearattempts',),
+        ('state', {'currentproblemid': current_problem_id + 1}),
+    ])
+
+
+def test_batch_in_journal_is_all_or_nothing(tmp_path):
+    snapshot_path, journal_path = str(tmp_path / 'data.pickle'), str(tmp_path / 'data.journal')
+    data = storage.JournaledStorage(snapshot_path, journal_path)
+    data.load()
+    data.commit(('attempt', 1, {'answered': True}))
+    data.snapshot()
+    data.commit(reset_op(0))
+    data.close()
+
+    size = os.path.getsize(journal_path)
+    for cut in (size, size - 1):  # complete, and torn by a crash in the middle of the write
+        os.truncate(journal_path, cut)
+        data = storage.JournaledStorage(snapshot_path, journal_path)
+        data.load()
+        if cut == size:
+            assert data.users[1]['totalscore'] == 110 and data.users[2]['totalscore'] == 220
+            assert data.attempts == {} and data.state['currentproblemid'] == 1
+        else:
+            assert 1 not in data.users and 2 not in data.users
+            assert data.attempts[1]['answered'] and data.state['currentproblemid'] == 0
+        data.close()
+
+
+def test_batch_in_sqlite_is_one_transaction(tmp_path):
+    data = storage.SQLiteStorage(str(tmp_path / 'data.sqlite3'))
+    data.load()
+    data.commit(('attempt', 1, {'answered': True}))
+    failing = ('batch', reset_op(0)[1] + [('user', 3, {'nosuchcolumn': 1})])
+    try:
+        data.commit(failing)
+    except ValueError:
+        pass
+    else:
+        raise AssertionError('the batch should have failed')
+    assert 1 not in data.users and 2 not in data.users
+    assert data.attempts[1]['answered'] and data.state['currentproblemid'] == 0
+
+    data.commit(reset_op(0))
+    data.close()
+    data = storage.SQLiteStorage(str(tmp_path / 'data.sqlite3'))
+    data.load()
+    assert data.users[1]['totalscore'] == 110 and data.users[2]['totalscore'] == 220
+    assert data.attempts == {} and data.state['currentproblemid'] == 1
+    data.close()
+
+
+def test_sqlite_rank_index_matches_scores(tmp_path):
+    data = storage.SQLiteStorage(str(tmp_path / 'data.sqlite3'))
+    data.load()
+    scores = {user_id: (user_id * 37) % 11 * 10 for user_id in range(1, 60)}
+    data.commit(('batch', [('user', user_id, {'totalscore': score}) for user_id, score in scores.items()]))
+    loaded, in_memory = data.rank_index(), storage.RankIndex(scores.items())
+
+    assert len(loaded) == len(in_memory) == len(scores)
+    for user_id in (*scores, 1000):
+        assert loaded.rank(user_id) == in_memory.rank(user_id)
+    for score in (0, 15, 50, 100, 101):
+        assert loaded.count_at_least(score) == in_memory.count_at_least(score)
+    for offset in (0, 10, 55):
+        assert loaded.page(offset, 10) == in_memory.page(offset, 10)
+    data.close()